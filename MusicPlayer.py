@@ -4,7 +4,10 @@ import mili
 import time
 import pygame
 import pathlib
+import threading
+import collections
 import faulthandler
+import multiprocessing
 
 pygame.mixer.pre_init(buffer=2048)
 
@@ -14,11 +17,22 @@ from ui.history import HistoryUI
 from ui.settings import SettingsUI
 from ui.list_viewer import ListViewerUI
 from ui.edit_keybinds import EditKeybindsUI
-from health_check import main as health_check
+from ui.global_search import GlobalSearchUI
+from health_check import check as health_check
 from ui.music_controls import MusicControlsUI
 from ui.playlist_viewer import PlaylistViewerUI
 from ui.discord_presence import DiscordPresence
 from ui.music_fullscreen import MusicFullscreenUI
+from ui.metadata import MetadataIndex
+from ui.media_cache import MediaCache
+from ui.cover_loader import CoverLoader
+from ui.conversion import ConversionQueue
+from ui.durations import DurationScanner
+from ui.video import VideoDecoder
+from ui.profiler import Profiler, profiled
+from ui.persistence import Persistence
+from ui.library_store import LibraryStore
+from ui.snapshot import load_snapshot, write_snapshot
 from ui.data import (
     HistoryData,
     MusicData,
@@ -53,7 +67,7 @@ class MusicPlayerApp(mili.GenericApp):
         self.init_sld2()
         self.init_try_set_icon_mac()
         self.make_bg_image()
-        health_check()
+        self.init_health_check()
 
     def init_pygame(self):
         pygame.mixer.init()
@@ -93,7 +107,16 @@ class MusicPlayerApp(mili.GenericApp):
         self.keybinds = Keybinds(self)
         self.edit_keybinds = EditKeybindsUI(self)
         self.music_fullscreen = MusicFullscreenUI(self)
+        self.global_search = GlobalSearchUI(self)
         self.prefabs = UIComponent(self)
+        self.persistence = Persistence()
+        self.library_store = LibraryStore()
+        self.metadata = MetadataIndex()
+        self.media_cache = MediaCache()
+        self.cover_loader = CoverLoader()
+        self.conversions = ConversionQueue()
+        self.durations = DurationScanner()
+        self.profiler = Profiler()
         # settings
         self.user_framerate = 60
         self.volume = 1
@@ -104,6 +127,7 @@ class MusicPlayerApp(mili.GenericApp):
         self.maximized = False
         self.strip_youtube_id = False
         self.taskbar_height = 0
+        self.library_backend = "json"
         # status
         self.start_style = mili.PADLESS | {"spacing": 0}
         self.start_time = time.time()
@@ -111,7 +135,10 @@ class MusicPlayerApp(mili.GenericApp):
         self.view_state = "list"
         self.modal_state = "none"
         self.playlists: list[Playlist] = []
-        self.history_data: list[HistoryData] = []
+        self.history_data: collections.OrderedDict[tuple, HistoryData] = (
+            collections.OrderedDict()
+        )
+        self.snapshot_valid = False
         self.focused = True
         self.ui_mult = 1
         self.input_stolen = False
@@ -124,7 +151,9 @@ class MusicPlayerApp(mili.GenericApp):
         # be effect/mili
         self.bg_effect_image = None
         self.bg_black_image = None
+        self.bg_ramp = None
         self.bg_effect = False
+        self.bg_effect_color = None
         self.bg_cache = mili.ImageCache()
         self.anims = [animation(-3) for i in range(4)]
         self.anim_settings = animation(-5)
@@ -180,9 +209,19 @@ class MusicPlayerApp(mili.GenericApp):
             if not os.path.exists(f"data/{name}"):
                 os.mkdir(f"data/{name}")
 
-        playlist_data = load_json("data/playlists.json", [])
-        write_json("data/playlists_backup.json", playlist_data)
-        history_data = load_json("data/history.json", [])
+        if self.library_backend == "sqlite" and self.library_store.open():
+            playlist_data = self.library_store.load_playlists()
+            history_data = self.library_store.load_history()
+        elif (snapshot := load_snapshot()) is not None:
+            playlist_data, history_data = snapshot
+            self.persistence.snapshots["data/playlists.json"] = playlist_data
+            self.persistence.snapshots["data/history.json"] = history_data
+            self.snapshot_valid = True
+        else:
+            playlist_data = self.persistence.load("data/playlists.json", [])
+            history_data = self.persistence.load("data/history.json", [])
+        self.metadata.load()
+        self.conversions.load()
 
         for pdata in playlist_data:
             name = pdata["name"]
@@ -196,10 +235,23 @@ class MusicPlayerApp(mili.GenericApp):
                 Playlist(name, paths, pdata.get("groups", []), self.loading_image)
             )
 
+        playlists = {playlist.name: playlist for playlist in self.playlists}
         for hdata in history_data:
-            obj = HistoryData.load_from_data(hdata, self)
+            obj = HistoryData.load_from_data(hdata, playlists)
             if obj is not None:
-                self.history_data.append(obj)
+                self.push_history(obj)
+
+        self.durations.scan_library(self.playlists)
+
+    def init_health_check(self):
+        data = [playlist.get_save_data() for playlist in self.playlists]
+        with self.metadata.lock:
+            signatures = {
+                key: entry["signature"] for key, entry in self.metadata.entries.items()
+            }
+        threading.Thread(
+            target=health_check, args=(data, False, signatures), daemon=True
+        ).start()
 
     def init_sld2(self):
         try:
@@ -228,7 +280,7 @@ class MusicPlayerApp(mili.GenericApp):
             (
                 sum(
                     [
-                        len(playlist.musiclist) + len(playlist.groups)
+                        playlist.track_count + len(playlist.groups)
                         for playlist in self.playlists
                     ]
                 )
@@ -237,6 +289,7 @@ class MusicPlayerApp(mili.GenericApp):
             * 3
         ) + 100
         mili.ImageCache.preallocate_caches(max(1000, minimum_caches))
+        self.mili.update_draw = profiled("mili_draw")(self.mili.update_draw)
 
     def init_load_settings(self):
         custom_title = True
@@ -245,7 +298,7 @@ class MusicPlayerApp(mili.GenericApp):
         discord_presence = False
         default_binds = self.keybinds.get_save_data()
         minip_data = [MINIP_PREFERRED_SIZES, None, True]
-        data = load_json(
+        data = self.persistence.load(
             "data/settings.json",
             {
                 "volume": 1,
@@ -260,6 +313,9 @@ class MusicPlayerApp(mili.GenericApp):
                 "discord_presence": discord_presence,
                 "strip_youtube_id": False,
                 "taskbar_height": 0,
+                "conversion_workers": 0,
+                "conversion_backend": "thread",
+                "library_backend": "json",
                 "miniplayer": minip_data,
                 "keybinds": default_binds,
             },
@@ -278,6 +334,9 @@ class MusicPlayerApp(mili.GenericApp):
             self.before_maximize_data = data.get("before_maximize_data", None)
             self.strip_youtube_id = data.get("strip_youtube_id", False)
             self.taskbar_height = data.get("taskbar_height", 0)
+            self.conversions.workers = data.get("conversion_workers", 0)
+            self.conversions.backend = data.get("conversion_backend", "thread")
+            self.library_backend = data.get("library_backend", "json")
             minip = self.music_controls.minip
             minip.last_size, minip.last_pos, minip.last_borderless = data.get(
                 "miniplayer", minip_data
@@ -376,18 +435,27 @@ class MusicPlayerApp(mili.GenericApp):
 
     def add_to_history(self):
         pos = self.get_music_pos()
-        data = HistoryData(self.music, pos, self.music.duration)
-        for olddata in self.history_data.copy():
-            if olddata.music is self.music:
-                self.history_data.remove(olddata)
-        self.history_data.append(data)
-        if len(self.history_data) > HISTORY_LEN:
-            self.history_data.pop(0)
+        self.push_history(HistoryData(self.music, pos, self.music.duration))
+
+    def push_history(self, data: HistoryData):
+        key = data.key
+        self.history_data[key] = data
+        self.history_data.move_to_end(key)
+        while len(self.history_data) > HISTORY_LEN:
+            self.history_data.popitem(last=False)
 
     def remove_from_history(self, music: MusicData):
-        for olddata in self.history_data.copy():
-            if olddata.music is music:
-                self.history_data.remove(olddata)
+        key = HistoryData.get_key(music.playlist, music.realpath)
+        self.history_data.pop(key, None)
+
+    def rekey_history(self):
+        self.history_data = collections.OrderedDict(
+            (history.key, history) for history in self.history_data.values()
+        )
+
+    def remove_playlist_from_history(self, playlist: Playlist):
+        for key in [key for key in self.history_data if key[0] is playlist]:
+            self.history_data.pop(key)
 
     def play_music(self, music: MusicData, idx):
         if music.pending:
@@ -395,6 +463,7 @@ class MusicPlayerApp(mili.GenericApp):
             return
         if self.music is not None:
             self.add_to_history()
+            self.music.release_full_cover()
         if not os.path.exists(music.audiopath):
             music.playlist.remove(music.audiopath)
             pygame.display.message_box(
@@ -410,20 +479,23 @@ class MusicPlayerApp(mili.GenericApp):
         self.music_index = idx
         self.music_start_time = time.time()
         self.music_play_offset = 0
-        if self.music.duration is NotCached:
-            self.music.cache_duration()
+        self.music.request_cover(COVER_PRIORITY_CURRENT)
+        self.music.request_duration(DURATION_PRIORITY_CURRENT)
 
+        if self.music_videoclip is not None:
+            self.music_videoclip.close()
         self.music_videoclip = None
         if self.music.isvideo:
-            try:
-                self.music_videoclip = moviepy.VideoFileClip(str(self.music.realpath))
-            except Exception:
-                pass
+            self.music_videoclip = VideoDecoder(
+                self.music.realpath, self.music_controls.get_video_size()
+            )
 
         self.music_controls.offset = 0
         self.music_controls.offset_restart_time = pygame.time.get_ticks()
         self.music_controls.music_videoclip_cover = None
         self.music_controls.last_videoclip_cover = None
+        self.music_controls.bg_source = None
+        self.music_controls.bg_color = None
 
         pygame.mixer.music.load(self.music.audiopath)
         pygame.mixer.music.play(0)
@@ -439,6 +511,7 @@ class MusicPlayerApp(mili.GenericApp):
             self.modal_state = "none"
         if self.music is not None:
             self.add_to_history()
+            self.music.release_full_cover()
         self.music = None
         self.music_paused = False
         self.bg_effect = False
@@ -454,23 +527,26 @@ class MusicPlayerApp(mili.GenericApp):
     def save(self):
         if self.music is not None:
             self.add_to_history()
-        playlist_data = [
-            {
-                "name": p.name,
-                "paths": [
-                    [str(m.realpath), "converted"] if m.converted else str(m.realpath)
-                    for m in p.musiclist
-                ],
-                "groups": [group.get_save_data() for group in p.groups],
-            }
-            for p in self.playlists
+        playlist_data = [p.get_save_data() for p in self.playlists]
+        history_data = [
+            history.get_save_data() for history in self.history_data.values()
         ]
-        history_data = [history.get_save_data() for history in self.history_data]
-        write_json("data/playlists.json", playlist_data)
-        write_json("data/history.json", history_data)
+        if self.library_store.active:
+            self.library_store.save(playlist_data, history_data)
+        else:
+            changed = self.persistence.write("data/playlists.json", playlist_data, True)
+            changed |= self.persistence.write("data/history.json", history_data, True)
+            if changed or not self.snapshot_valid:
+                self.persistence.submit(
+                    SNAPSHOT_PATH, write_snapshot, playlist_data, history_data
+                )
+                self.snapshot_valid = True
+        self.metadata.prune([path for p in self.playlists for path in p.realpaths])
+        self.metadata.save()
+        self.conversions.save()
         minip = self.music_controls.minip
         minip.save_state()
-        write_json(
+        self.persistence.write(
             "data/settings.json",
             {
                 "volume": self.volume,
@@ -485,6 +561,9 @@ class MusicPlayerApp(mili.GenericApp):
                 "discord_presence": self.discord_presence.active,
                 "strip_youtube_id": self.strip_youtube_id,
                 "taskbar_height": self.taskbar_height,
+                "conversion_workers": self.conversions.workers,
+                "conversion_backend": self.conversions.backend,
+                "library_backend": self.library_backend,
                 "miniplayer": [minip.last_size, minip.last_pos, minip.last_borderless],
                 "keybinds": self.keybinds.get_save_data(),
             },
@@ -497,10 +576,13 @@ class MusicPlayerApp(mili.GenericApp):
                     )
         print("Data saved correctly")
 
+    @profiled("update")
     def update(self):
         if pygame.time.get_ticks() - self.last_save >= SAVE_COOLDOWN:
             self.last_save = pygame.time.get_ticks()
             self.save()
+        for music, job in self.conversions.take_finished():
+            music.conversion_finished(job)
 
         self.target_framerate = self.user_framerate
         if (
@@ -556,6 +638,10 @@ class MusicPlayerApp(mili.GenericApp):
         if len(mili.get_font_cache()) > 20:
             mili.clear_font_cache()
 
+        self.global_search.library.sync(self.playlists)
+        self.durations.apply()
+
+    @profiled("ui")
     def ui(self):
         self.mili.rect({"color": (BG_CV,) * 3, "border_radius": 0})
         if self.custom_title:
@@ -592,6 +678,8 @@ class MusicPlayerApp(mili.GenericApp):
                 self.history.ui()
             elif self.modal_state == "keybinds":
                 self.edit_keybinds.ui()
+            elif self.modal_state == "global_search":
+                self.global_search.ui()
 
             self.mili.id_checkpoint(5000)
             self.music_controls.ui()
@@ -615,12 +703,19 @@ class MusicPlayerApp(mili.GenericApp):
             and self.custom_title
             and pygame.key.get_pressed()[pygame.K_BACKSLASH]
         ):
+            video_allocations = "-"
+            if self.music_videoclip is not None:
+                video_allocations = self.music_videoclip.allocations
             self.mili.text_element(
-                f"developer version {DEV_VERSION}",
+                f"developer version {DEV_VERSION} | "
+                f"cover queue {self.cover_loader.queue_depth} | "
+                f"video allocations {video_allocations}",
                 {"size": self.mult(13), "color": (100,) * 3},
                 None,
                 mili.FLOATING,
             )
+        if self.profiler.enabled:
+            self.ui_profiler()
 
         if self.modal_state != "none" and self.menu_data != "controls":
             self.close_menu()
@@ -643,6 +738,53 @@ class MusicPlayerApp(mili.GenericApp):
         if not self.custom_borders.dragging and not self.custom_borders.resizing:
             self.custom_borders.cumulative_relative = pygame.Vector2()
 
+    def ui_profiler(self):
+        txtstyle = {"size": self.mult(13), "color": (150,) * 3}
+        with self.mili.begin(
+            (self.mult(5), self.tbarh + self.mult(5), 0, 0),
+            {
+                "resizex": True,
+                "resizey": True,
+                "ignore_grid": True,
+                "blocking": False,
+                "parent_id": 0,
+                "z": 99998,
+                "padx": self.mult(5),
+                "pady": self.mult(5),
+                "spacing": self.mult(2),
+            },
+        ):
+            self.mili.rect({"color": (10,) * 3, "border_radius": 0})
+            self.mili.text_element(
+                f"developer version {DEV_VERSION} | avg / p95 / max ms",
+                txtstyle,
+                None,
+                {"blocking": False},
+            )
+            for name in list(self.profiler.samples.keys()):
+                avg, p95, peak = self.profiler.get_stats(name)
+                histogram = self.profiler.get_histogram(name)
+                total = max(1, sum(histogram))
+                with self.mili.begin(
+                    None,
+                    {"resizex": True, "resizey": True, "blocking": False}
+                    | mili.PADLESS
+                    | mili.X,
+                ):
+                    for count in histogram:
+                        height = max(1, self.mult(14) * count / total)
+                        if self.mili.element(
+                            (0, 0, self.mult(5), height),
+                            {"align": "last", "blocking": False},
+                        ):
+                            self.mili.rect({"color": (120,) * 3, "border_radius": 0})
+                    self.mili.text_element(
+                        f"{name} {avg:.2f} / {p95:.2f} / {peak:.2f}",
+                        txtstyle,
+                        None,
+                        {"blocking": False},
+                    )
+
     def ui_tooltip(self):
         pad = self.mult(2)
         txtstyle = {
@@ -845,14 +987,31 @@ class MusicPlayerApp(mili.GenericApp):
             return True
         return not self.music_controls.minip.focused and self.focused
 
+    def set_bg_color(self, color):
+        self.bg_effect = True
+        if color != self.bg_effect_color:
+            self.bg_effect_color = color
+            self.bg_effect_image.fill(color)
+
     def make_bg_image(self):
-        self.bg_black_image = pygame.Surface(self.window.size, pygame.SRCALPHA)
-        self.bg_effect_image = pygame.Surface(self.window.size, pygame.SRCALPHA)
-        for i in range(self.bg_black_image.height):
-            alpha = pygame.math.lerp(0, 255, i / (self.bg_black_image.height / 1.5))
-            self.bg_black_image.fill(
-                (0, 0, 0, alpha), (0, i, self.bg_black_image.width, 1)
-            )
+        size = tuple(self.window.size)
+        if self.bg_black_image is not None and self.bg_black_image.get_size() == size:
+            return
+        self.bg_black_image = self.make_bg_gradient(size)
+        self.bg_effect_image = pygame.Surface(size, pygame.SRCALPHA)
+        self.bg_effect_color = None
+
+    def make_bg_gradient(self, size):
+        if self.bg_ramp is None:
+            self.bg_ramp = pygame.Surface((1, 256), pygame.SRCALPHA)
+            for i in range(256):
+                self.bg_ramp.set_at((0, i), (0, 0, 0, i))
+        image = pygame.Surface(size, pygame.SRCALPHA)
+        image.fill((0, 0, 0, 255))
+        height = max(1, int(size[1] / 1.5))
+        ramp = pygame.transform.scale(self.bg_ramp, (size[0], height))
+        image.blit(ramp, (0, 0), special_flags=pygame.BLEND_RGBA_MIN)
+        return image
 
     def event(self, event):
         self.shortcuts_event(event)
@@ -883,6 +1042,9 @@ class MusicPlayerApp(mili.GenericApp):
         elif self.modal_state == "fullscreen":
             if self.music_fullscreen.event(event):
                 return
+        elif self.modal_state == "global_search":
+            if self.global_search.event(event):
+                return
         if self.view_state == "list":
             self.list_viewer.event(event)
         elif self.view_state == "playlist":
@@ -915,30 +1077,39 @@ class MusicPlayerApp(mili.GenericApp):
                 elif Keybinds.check("open_keybinds", event):
                     self.open_settings()
                     self.settings.action_keybinds()
+                elif Keybinds.check("toggle_profiler", event):
+                    self.profiler.toggle()
+                elif Keybinds.check("global_search", event):
+                    if self.modal_state == "global_search":
+                        self.global_search.close()
+                    else:
+                        self.global_search.open()
                 elif Keybinds.check("minimize_window", event):
                     self.action_minimize()
                 elif Keybinds.check("maximize_window", event):
                     self.action_maximize()
 
     def quit(self):
-        for playlist in self.playlists:
-            for music in playlist.musiclist:
-                if music.pending:
-                    btn = pygame.display.message_box(
-                        "Wait before closing",
-                        "Some tracks are still being converted. Please wait until they are converted "
-                        "before closing the application, otherwise the files will be corrupted.",
-                        "warn",
-                        None,
-                        ("Understood", "Close Anyways"),
-                    )
-                    if btn == 0:
-                        return
+        if self.conversions.active:
+            btn = pygame.display.message_box(
+                "Wait before closing",
+                "Some tracks are still being converted. If you close the application now, "
+                "the unfinished conversions will start over the next time it is opened.",
+                "warn",
+                None,
+                ("Understood", "Close Anyways"),
+            )
+            if btn == 0:
+                return
         self.save()
+        self.persistence.flush()
+        self.library_store.close()
+        self.conversions.shutdown()
         print("Application quit")
         pygame.quit()
         raise SystemExit
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     MusicPlayerApp().run()
@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import time
+import wave
+import random
+import shutil
+import pathlib
+import argparse
+import tempfile
+import platform
+import tracemalloc
+import subprocess
+
+SEARCH_QUERIES = ["a", "track", "song 1", "artst", "playlist 2 song", "zzz"]
+WORDS = ["love", "night", "river", "light", "dream", "fire", "ocean", "storm"]
+
+
+def peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return usage
+    return usage * 1024
+
+
+def make_wav(path):
+    with wave.open(str(path), "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(1)
+        file.setframerate(8000)
+        file.writeframes(bytes(random.randrange(256) for i in range(4000)))
+
+
+def make_video(path):
+    try:
+        import imageio_ffmpeg
+
+        subprocess.run(
+            [
+                imageio_ffmpeg.get_ffmpeg_exe(),
+                "-y",
+                "-v",
+                "error",
+                "-f",
+                "lavfi",
+                "-i",
+                "testsrc=size=64x64:rate=10:duration=1",
+                "-f",
+                "lavfi",
+                "-i",
+                "sine=duration=1",
+                "-shortest",
+                str(path),
+            ],
+            check=True,
+            capture_output=True,
+        )
+    except Exception as exc:
+        print(f"Could not generate a stub video, videos are disabled: {exc}")
+        return False
+    return True
+
+
+def generate_library(root: pathlib.Path, args):
+    random.seed(args.seed)
+    music_folder = root / "music"
+    music_folder.mkdir()
+    wav_template = root / "template.wav"
+    make_wav(wav_template)
+    video_template = root / "template.mp4"
+    videos = args.video_ratio > 0 and make_video(video_template)
+
+    playlists = []
+    history = []
+    for p in range(args.playlists):
+        folder = music_folder / f"playlist {p}"
+        folder.mkdir()
+        paths = []
+        for t in range(args.tracks):
+            name = f"Artist {random.choice(WORDS)} - Playlist {p} Song {t}"
+            if videos and random.random() < args.video_ratio:
+                path = folder / f"{name}.mp4"
+                shutil.copyfile(video_template, path)
+                paths.append([str(path), "converted"])
+            else:
+                path = folder / f"{name}.wav"
+                shutil.copyfile(wav_template, path)
+                paths.append(str(path))
+        groups = []
+        size = args.tracks // (args.groups * 2) if args.groups > 0 else 0
+        for g in range(args.groups if size > 0 else 0):
+            members = paths[g * size * 2 : g * size * 2 + size]
+            groups.append(
+                {
+                    "name": f"Group {g}",
+                    "paths": [m[0] if isinstance(m, list) else m for m in members],
+                    "idx": g,
+                    "collapsed": g % 2 == 0,
+                    "mode": "h" if g % 2 == 0 else "v",
+                }
+            )
+        playlists.append({"name": f"Playlist {p}", "paths": paths, "groups": groups})
+        if p < args.history and len(paths) > 0:
+            first = paths[0][0] if isinstance(paths[0], list) else paths[0]
+            history.append(
+                {
+                    "audiopath": first,
+                    "position": 0,
+                    "playlist": f"Playlist {p}",
+                    "duration": "not cached",
+                }
+            )
+
+    data = root / "data"
+    with open(data / "playlists.json", "w") as file:
+        json.dump(playlists, file)
+    with open(data / "history.json", "w") as file:
+        json.dump(history, file)
+
+
+def run_frame(app):
+    import pygame
+
+    for event in pygame.event.get():
+        app.event(event)
+    app.mili.start(app.start_style)
+    app.update()
+    app.ui()
+    app.mili.update_draw()
+    app.window.flip()
+
+
+class Timer:
+    def __init__(self):
+        self.results = {}
+
+    def measure(self, name, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.results[name] = time.perf_counter() - start
+        return result
+
+
+def run_benchmark(root: pathlib.Path, args):
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    sys.path.insert(0, str(pathlib.Path(__file__).parent.resolve()))
+    os.chdir(root)
+    if args.tracemalloc:
+        tracemalloc.start()
+    timer = Timer()
+
+    import pygame
+    import MusicPlayer
+    from ui.common import DEV_VERSION
+    from ui.data import Playlist, HistoryData
+    from ui.common import orjson
+    from ui.snapshot import encode_snapshot, decode_snapshot
+
+    with open("data/playlists.json", "r") as file:
+        playlist_text = file.read()
+    with open("data/history.json", "r") as file:
+        history_text = file.read()
+    playlist_data = json.loads(playlist_text)
+    snapshot = encode_snapshot(playlist_data, json.loads(history_text), [])
+    timer.measure(
+        "decode_json", lambda: (json.loads(playlist_text), json.loads(history_text))
+    )
+    if orjson is not None:
+        timer.measure(
+            "decode_orjson",
+            lambda: (orjson.loads(playlist_text), orjson.loads(history_text)),
+        )
+    timer.measure("decode_snapshot", decode_snapshot, snapshot)
+    app = timer.measure("app_init", MusicPlayer.MusicPlayerApp)
+
+    def construct_playlists():
+        playlists = [
+            Playlist(
+                pdata["name"],
+                [
+                    pathlib.Path(path)
+                    if isinstance(path, str)
+                    else [pathlib.Path(path[0]), path[1]]
+                    for path in pdata["paths"]
+                ],
+                pdata["groups"],
+            )
+            for pdata in playlist_data
+        ]
+        for playlist in playlists:
+            playlist.load()
+        for playlist in playlists:
+            playlist.release_cache()
+
+    def load_playlists():
+        for playlist in app.playlists:
+            playlist.load()
+
+    def sort_group_musics():
+        for playlist in app.playlists:
+            playlist.invalidate()
+            playlist.get_group_sorted_musics(paths=True)
+
+    def search_playlists():
+        viewer = app.playlist_viewer
+        for playlist in app.playlists:
+            viewer.playlist = playlist
+            for query in SEARCH_QUERIES:
+                viewer.search_entryline.text = query
+                viewer.sort_searched_songs()
+
+    def update_history():
+        for playlist in app.playlists:
+            for music in playlist.musiclist:
+                app.push_history(HistoryData(music, 0, music.duration))
+
+    def save():
+        app.save()
+        app.persistence.flush()
+
+    def run_frames():
+        for i in range(args.frames):
+            run_frame(app)
+
+    timer.measure("playlist_construction", construct_playlists)
+    timer.measure("playlist_load", load_playlists)
+    timer.measure("get_group_sorted_musics", sort_group_musics)
+    timer.measure("sort_searched_songs", search_playlists)
+    timer.measure("history_updates", update_history)
+    timer.measure("save", save)
+    app.change_state("list")
+    timer.measure("frames_list", run_frames)
+    if len(app.playlists) > 0:
+        app.playlist_viewer.enter(app.playlists[0])
+    timer.measure("frames_playlist", run_frames)
+    app.modal_state = "history"
+    timer.measure("frames_history", run_frames)
+
+    report = {
+        "dev_version": DEV_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "playlists": args.playlists,
+            "tracks": args.tracks,
+            "groups": args.groups,
+            "video_ratio": args.video_ratio,
+            "frames": args.frames,
+        },
+        "timings": timer.results,
+        "sizes": {
+            "json": len(playlist_text.encode()) + len(history_text.encode()),
+            "snapshot": len(snapshot),
+        },
+        "frame_time": {
+            "list": timer.results["frames_list"] / max(1, args.frames),
+            "playlist": timer.results["frames_playlist"] / max(1, args.frames),
+            "history": timer.results["frames_history"] / max(1, args.frames),
+        },
+        "peak_rss": peak_rss(),
+        "peak_traced": tracemalloc.get_traced_memory()[1]
+        if args.tracemalloc
+        else None,
+    }
+    app.conversions.shutdown()
+    pygame.quit()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the music player on a synthetic library"
+    )
+    parser.add_argument("--playlists", type=int, default=20)
+    parser.add_argument("--tracks", type=int, default=100)
+    parser.add_argument("--groups", type=int, default=2)
+    parser.add_argument("--history", type=int, default=10)
+    parser.add_argument("--video-ratio", type=float, default=0)
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action="store_true")
+    parser.add_argument("--keep", action="store_true")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    source = pathlib.Path(__file__).parent.resolve()
+    output = pathlib.Path(args.output).resolve() if args.output else None
+    root = pathlib.Path(tempfile.mkdtemp(prefix="musicplayer_benchmark_"))
+    try:
+        shutil.copytree(source / "data" / "icons", root / "data" / "icons")
+        shutil.copyfile(source / "data" / "ytfont.ttf", root / "data" / "ytfont.ttf")
+        generate_library(root, args)
+        report = run_benchmark(root, args)
+    finally:
+        os.chdir(source)
+        if args.keep:
+            print(f"Benchmark library kept in '{root}'")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(report, indent=4)
+    if output is not None:
+        with open(output, "w") as file:
+            file.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import os
 import sys
 import json
+import sqlite3
 import pathlib
+from ui import media_cache
 
 
 class Playlist:
@@ -18,7 +20,7 @@ class Playlist:
         for path in self.filepaths:
             if isinstance(path, list):
                 path = path[0]
-                mp3_path = f"{self.name}_{path.stem}.mp3"
+                mp3_path = f"{self.name}_{path.stem}"
                 self.mp3_paths.append(mp3_path)
             if path.suffix[1:].lower() in [
                 "mp4",
@@ -46,19 +48,35 @@ class Playlist:
                 "tta",
                 "caf",
             ]:
-                mp3_path = f"{self.name}_{path.stem}.mp3"
+                mp3_path = f"{self.name}_{path.stem}"
                 self.mp3_paths.append(mp3_path)
             cover_path = f"{self.name}_{path.stem}.png"
             self.cover_paths.append(cover_path)
 
 
-def check_iterate(playlists: list[Playlist], path, mode):
+def get_reachable_keys(playlists: list[Playlist], signatures=None):
+    if signatures is None:
+        signatures = {}
+    keys = set()
+    for playlist in playlists:
+        for path in playlist.filepaths:
+            if isinstance(path, list):
+                path = path[0]
+            key = media_cache.cache_key(path, signatures.get(str(path), None))
+            if key is not None:
+                keys.add(key)
+    return keys
+
+
+def check_iterate(playlists: list[Playlist], path, mode, reachable=None):
+    if mode in ["mp3", "covers"] and media_cache.is_cache_file(path):
+        return path.split(".", 1)[0] in reachable
     for playlist in playlists:
         if mode == "cover":
             if playlist.cover_path == path:
                 return True
         elif mode == "mp3":
-            if path in playlist.mp3_paths:
+            if os.path.splitext(path)[0] in playlist.mp3_paths:
                 return True
         elif mode == "covers":
             if path in playlist.cover_paths:
@@ -66,15 +84,46 @@ def check_iterate(playlists: list[Playlist], path, mode):
     return False
 
 
-def main():
-    do_remove = len(sys.argv) > 1 and sys.argv[1] == "--remove"
+def load_library_db():
+    connection = sqlite3.connect("data/library.db")
+    try:
+        data = []
+        for playlist_id, name in connection.execute(
+            "SELECT id, name FROM playlists ORDER BY position"
+        ).fetchall():
+            paths = [
+                [path, "converted"] if converted else path
+                for path, converted in connection.execute(
+                    "SELECT tracks.path, playlist_tracks.converted "
+                    "FROM playlist_tracks JOIN tracks ON tracks.id = playlist_tracks.track_id "
+                    "WHERE playlist_tracks.playlist_id = ? ORDER BY playlist_tracks.position",
+                    (playlist_id,),
+                )
+            ]
+            data.append({"name": name, "paths": paths})
+        return data
+    finally:
+        connection.close()
+
+
+def load_playlist_data():
+    backend = "json"
+    if os.path.exists("data/settings.json"):
+        with open("data/settings.json", "r") as file:
+            backend = json.load(file).get("library_backend", "json")
 
     data = []
-    if os.path.exists("data/playlists.json"):
+    if backend == "sqlite" and os.path.exists("data/library.db"):
+        data = load_library_db()
+    elif os.path.exists("data/playlists.json"):
         with open("data/playlists.json", "r") as file:
             data = json.load(file)
+    return data
+
 
+def check(data, do_remove=False, signatures=None):
     playlists = [Playlist(pdata["name"], pdata["paths"]) for pdata in data]
+    reachable = get_reachable_keys(playlists, signatures)
 
     anyf1 = False
     if os.path.exists("data/covers"):
@@ -91,7 +140,7 @@ def main():
     anyf2 = False
     if os.path.exists("data/music_covers"):
         for file in os.listdir("data/music_covers"):
-            if not check_iterate(playlists, file, "covers"):
+            if not check_iterate(playlists, file, "covers", reachable):
                 path = f"data/music_covers/{file}"
                 if do_remove:
                     print(f"Removing unused music cover: '{path}'")
@@ -103,7 +152,7 @@ def main():
     anyf3 = False
     if os.path.exists("data/mp3_converted"):
         for file in os.listdir("data/mp3_converted"):
-            if not check_iterate(playlists, file, "mp3"):
+            if not check_iterate(playlists, file, "mp3", reachable):
                 path = f"data/mp3_converted/{file}"
                 if do_remove:
                     print(f"Removing unused MP3 file: '{path}'")
@@ -131,5 +180,10 @@ def main():
         )
 
 
+def main():
+    do_remove = len(sys.argv) > 1 and sys.argv[1] == "--remove"
+    check(load_playlist_data(), do_remove)
+
+
 if __name__ == "__main__":
     main()
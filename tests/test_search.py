@@ -0,0 +1,31 @@
+import unittest
+from ui.search import SearchIndex, edit_distance
+
+
+class TranspositionTests(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex()
+        for i, name in enumerate(
+            [
+                "The Beatles - Let It Be",
+                "Nirvana - Come As You Are",
+                "Queen - Bohemian Rhapsody",
+                "Daft Punk - Get Lucky",
+            ]
+        ):
+            self.index.add(i, name)
+
+    def test_edit_distance_counts_swaps_once(self):
+        self.assertEqual(edit_distance("beatels", "beatles", 1), 1)
+        self.assertEqual(edit_distance("nirvnaa", "nirvana", 1), 1)
+
+    def test_swapped_letters_match(self):
+        self.assertEqual(self.index.top("beatels", 10, lambda obj: obj), [0])
+        self.assertEqual(self.index.top("nirvnaa", 10, lambda obj: obj), [1])
+
+    def test_exact_match_still_ranks_first(self):
+        self.assertEqual(self.index.top("queen", 10, lambda obj: obj)[0], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -122,10 +122,9 @@ class AddToGroupUI(UIComponent):
     def add(self, group: PlaylistGroup):
         self.music.group = group
         group.musics.append(self.music)
+        self.music.playlist.invalidate()
         if self.music is self.app.music:
-            self.app.music_index = self.music.playlist.get_group_sorted_musics().index(
-                self.music
-            )
+            self.app.music_index = self.music.playlist.index_of(self.music)
 
         self.close()
 
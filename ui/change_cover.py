@@ -163,6 +163,8 @@ class ChangeCoverUI(UIComponent):
 
         playlist = self.app.playlist_viewer.playlist
         allmusics = playlist.get_group_sorted_musics()
+        for music in allmusics[:5] + allmusics[-4:]:
+            music.request_cover()
         shift = pygame.key.get_pressed()[pygame.K_LSHIFT]
         if len(allmusics) <= 0:
             self.message = "Cannot generate from empty playlist"
@@ -3,6 +3,12 @@ import mili
 import json
 import pygame
 import typing
+from ui.search import strip_youtube_id
+
+try:
+    import orjson
+except (ImportError, ModuleNotFoundError):
+    orjson = None
 
 # when width is double height make the controls split screen
 
@@ -49,7 +55,7 @@ FORMATS = (
 )
 POS_UNSUPPORTED = ["wav", "opus", "wv", "aiff"]
 MUSIC_ENDEVENT = pygame.event.custom_type()
-HISTORY_LEN = 100
+HISTORY_LEN = 10000
 RESIZE_SIZE = 3
 WIN_MIN_SIZE = (200, 300)
 DISCORD_COOLDOWN = 20000
@@ -76,6 +82,41 @@ ALPHA = 180
 BORDER_CV = 100
 TOPB_CV = 15, 25, 8
 GROUP_CV = MUSIC_CV  # 15, 25, 10
+METADATA_PATH = "data/metadata.json"
+COVER_WORKERS = 4
+COVER_PRIORITY_CURRENT = 0
+COVER_PRIORITY_VISIBLE = 1
+COVER_PRIORITY_PREFETCH = 2
+COVER_PREFETCH_ROWS = 20
+COVER_THUMB_SIZE = 128
+COVER_LARGE_SIZE = 512
+CONVERSIONS_PATH = "data/conversions.json"
+CONVERSION_PRIORITY_USER = 0
+CONVERSION_PRIORITY_IMPORT = 1
+PROCESS_POLL_TIME = 0.2
+STREAM_COPY_CODECS = {"mp3": "mp3", "vorbis": "ogg", "opus": "ogg"}
+SEARCH_LIMIT = 200
+GLOBAL_SEARCH_LIMIT = 50
+DURATION_PRIORITY_CURRENT = 0
+DURATION_PRIORITY_LOADED = 1
+DURATION_PRIORITY_SCAN = 2
+DURATION_SCAN_DELAY = 0.01
+VIDEO_RING_SIZE = 8
+VIDEO_SEEK_TOLERANCE = 1
+VIDEO_FALLBACK_FPS = 30
+VIDEO_SIZE_STEP = 64
+PALETTE_SAMPLE = 16
+BG_VIDEO_INTERVAL = 250
+PROFILER_SAMPLES = 240
+PROFILER_TRACE_LEN = 50000
+PROFILER_BUCKETS = (1, 2, 4, 8, 16, 33)
+PROFILER_TRACE_PATH = "data/profile_trace.json"
+JOURNAL_FOLDER = "data/journal"
+JOURNAL_SIZE = 10
+PERSISTENCE_FLUSH_TIMEOUT = 1
+LIBRARY_DB_PATH = "data/library.db"
+SNAPSHOT_PATH = "data/library.snapshot"
+SNAPSHOT_VERSION = 1
 
 
 def cond(app: "MusicPlayerApp", it: mili.Interaction, normal, hover, press):
@@ -88,10 +129,25 @@ def cond(app: "MusicPlayerApp", it: mili.Interaction, normal, hover, press):
     return normal
 
 
+def dump_json(content):
+    if orjson is not None:
+        try:
+            return orjson.dumps(content).decode()
+        except TypeError:
+            pass
+    return json.dumps(content)
+
+
+def parse_json(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
 def load_json(path, content_if_not_exist):
     if os.path.exists(path):
         with open(path, "r") as file:
-            return json.load(file)
+            return parse_json(file.read())
     else:
         with open(path, "w") as file:
             json.dump(content_if_not_exist, file)
@@ -99,8 +155,22 @@ def load_json(path, content_if_not_exist):
 
 
 def write_json(path, content):
-    with open(path, "w") as file:
-        json.dump(content, file)
+    write_text(path, dump_json(content))
+
+
+def write_text(path, text):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    if os.name != "nt":
+        folder = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(folder)
+        finally:
+            os.close(folder)
 
 
 def load_icon(name):
@@ -144,10 +214,7 @@ def handle_wheel_scroll(
 
 def parse_music_stem(app: "MusicPlayerApp", stem: str):
     if app.strip_youtube_id:
-        if len(stem) >= 14:
-            if stem.endswith("]") and stem[-13] == "[" and stem[-14] == " ":
-                return stem[:-14]
-        return stem
+        return strip_youtube_id(stem)
     return stem
 
 
@@ -447,6 +514,8 @@ class Keybinds:
             "open_history": Binding(pygame.K_h, ctrl=True),
             "open_keybinds": Binding(pygame.K_k, ctrl=True),
             "toggle_search": Binding(pygame.K_f, ctrl=True),
+            "global_search": Binding(pygame.K_g, ctrl=True),
+            "toggle_profiler": Binding(pygame.K_p, ctrl=True),
             "erase_input": Binding(pygame.K_BACKSPACE, ctrl=True),
             "change_cover": Binding(pygame.K_c, ctrl=True),
             "end_music": Binding(pygame.K_e, ctrl=True),
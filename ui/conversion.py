@@ -0,0 +1,438 @@
+import os
+import re
+import heapq
+import pygame
+import pathlib
+import proglog
+import itertools
+import threading
+import subprocess
+import imageio_ffmpeg
+import multiprocessing
+import concurrent.futures
+import moviepy.editor as moviepy
+from ui.common import *
+from ui.persistence import Persistence
+
+
+class ConversionCancelled(Exception): ...
+
+
+def run_ffmpeg(*args):
+    params = {}
+    if os.name == "nt":
+        params["creationflags"] = subprocess.CREATE_NO_WINDOW
+    return subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", *args],
+        capture_output=True,
+        text=True,
+        errors="replace",
+        **params,
+    )
+
+
+def probe_audio_codec(source):
+    try:
+        result = run_ffmpeg("-i", str(source))
+    except Exception:
+        return None
+    match = re.search(r"Stream #\d+:\d+.*?: Audio: (\w+)", result.stderr)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def probe_duration(source):
+    try:
+        result = run_ffmpeg("-i", str(source))
+    except Exception:
+        return None
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if match is None:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def stream_copy_audio(source, temp_path):
+    result = run_ffmpeg(
+        "-y",
+        "-v",
+        "error",
+        "-i",
+        str(source),
+        "-vn",
+        "-map",
+        "0:a:0",
+        "-c:a",
+        "copy",
+        str(temp_path),
+    )
+    return result.returncode == 0
+
+
+def convert_audio(source, new_path, isvideo, logger, job_id, pick_extension=False):
+    clip = None
+    new_path = pathlib.Path(new_path)
+    extension = STREAM_COPY_CODECS.get(probe_audio_codec(source), None)
+    if pick_extension and extension is not None:
+        new_path = new_path.with_suffix(f".{extension}")
+    temp_path = new_path.with_suffix(f".part{job_id}{new_path.suffix}")
+    try:
+        if extension == new_path.suffix[1:]:
+            if stream_copy_audio(source, temp_path):
+                os.replace(temp_path, new_path)
+                return str(new_path)
+        if isvideo:
+            clip = moviepy.VideoFileClip(str(source))
+            audiofile = clip.audio
+            if audiofile is None:
+                raise RuntimeError("the video has no associated audio")
+        else:
+            clip = audiofile = moviepy.AudioFileClip(str(source))
+        audiofile.write_audiofile(str(temp_path), logger=logger)
+        os.replace(temp_path, new_path)
+        return str(new_path)
+    finally:
+        if clip is not None:
+            clip.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def convert_audio_process(source, new_path, isvideo, state, job_id, pick_extension):
+    return convert_audio(
+        source, new_path, isvideo, ConversionLogger(state), job_id, pick_extension
+    )
+
+
+def extract_video_cover(source, cover_path):
+    clip = moviepy.VideoFileClip(source)
+    try:
+        frame = clip.get_frame(clip.duration / 2)
+        surface = pygame.surfarray.make_surface(frame.swapaxes(0, 1))
+        pygame.image.save(surface, cover_path)
+    finally:
+        clip.close()
+
+
+class SharedJobState:
+    def __init__(self, shared, key):
+        self.shared = shared
+        self.key = key
+
+    @property
+    def cancelled(self):
+        return self.shared.get(f"{self.key}_cancelled", False)
+
+    @property
+    def progress(self):
+        return self.shared.get(self.key, 0)
+
+    @progress.setter
+    def progress(self, value):
+        self.shared[self.key] = value
+
+    def cancel(self):
+        self.shared[f"{self.key}_cancelled"] = True
+
+    def clear(self):
+        self.shared.pop(self.key, None)
+        self.shared.pop(f"{self.key}_cancelled", None)
+
+
+class ConversionLogger(proglog.ProgressBarLogger):
+    def __init__(self, job: "ConversionJob|SharedJobState"):
+        super().__init__()
+        self.job = job
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if self.job.cancelled:
+            raise ConversionCancelled
+        if attr == "index":
+            total = self.bars[bar].get("total", None)
+            if total:
+                self.job.progress = min(1, value / total)
+
+
+class ConversionJob:
+    def __init__(self, music, new_path, priority, job_id, audio_converting=False):
+        self.music = music
+        self.id = job_id
+        self.musics = [music]
+        self.source = music.realpath
+        self.new_path = pathlib.Path(new_path)
+        self.final_path = self.new_path
+        self.priority = priority
+        self.audio_converting = audio_converting
+        self.progress = 0
+        self.running = False
+        self.cancelled = False
+        self.state: SharedJobState = None
+
+    def get_save_data(self):
+        return {
+            "source": str(self.source),
+            "target": str(self.new_path),
+            "audio_converting": self.audio_converting,
+        }
+
+    def run(self):
+        path = convert_audio(
+            self.source,
+            self.new_path,
+            self.music.isvideo,
+            ConversionLogger(self),
+            self.id,
+            not self.audio_converting,
+        )
+        self.final_path = pathlib.Path(path)
+
+    def run_process(self, pool: concurrent.futures.ProcessPoolExecutor, state):
+        self.state = state
+        future = pool.submit(
+            convert_audio_process,
+            str(self.source),
+            str(self.new_path),
+            self.music.isvideo,
+            state,
+            self.id,
+            not self.audio_converting,
+        )
+        try:
+            while True:
+                try:
+                    self.final_path = pathlib.Path(future.result(PROCESS_POLL_TIME))
+                    return
+                except concurrent.futures.TimeoutError:
+                    self.progress = state.progress
+                    if self.cancelled:
+                        state.cancel()
+        finally:
+            state.clear()
+
+
+class CoverJob:
+    def __init__(self, music, cover_path, priority):
+        self.music = music
+        self.cover_path = cover_path
+        self.priority = priority
+        self.running = False
+        self.cancelled = False
+
+    def run(self):
+        try:
+            extract_video_cover(str(self.music.realpath), self.cover_path)
+        except Exception as exc:
+            self.music.cover_extracted(self.cover_path, exc)
+        else:
+            self.music.cover_extracted(self.cover_path, None)
+
+
+class ConversionQueue:
+    instance: "ConversionQueue" = None
+
+    def __init__(self, workers=0, backend="thread"):
+        self.workers = workers
+        self.backend = backend
+        self.pool: concurrent.futures.ProcessPoolExecutor = None
+        self.manager = None
+        self.shared = None
+        self.threads: list[threading.Thread] = []
+        self.queue = []
+        self.jobs: dict["MusicData", ConversionJob] = {}
+        self.targets: dict[str, ConversionJob] = {}
+        self.failed: list["MusicData"] = []
+        self.finished: list[tuple["MusicData", ConversionJob]] = []
+        self.resume: dict[str, dict] = {}
+        self.counter = itertools.count()
+        self.version = 0
+        self.condition = threading.Condition()
+        self.pool_lock = threading.Lock()
+        ConversionQueue.instance = self
+
+    @property
+    def active(self):
+        return len(self.jobs) > 0
+
+    @property
+    def worker_amount(self):
+        return self.workers if self.workers > 0 else (os.cpu_count() or 1)
+
+    def get_pool(self):
+        if self.pool is None:
+            with self.pool_lock:
+                if self.pool is None:
+                    self.manager = multiprocessing.Manager()
+                    self.shared = self.manager.dict()
+                    self.pool = concurrent.futures.ProcessPoolExecutor(
+                        self.worker_amount
+                    )
+        return self.pool
+
+    def extract_cover(
+        self, music: "MusicData", cover_path, priority=CONVERSION_PRIORITY_IMPORT
+    ):
+        if self.backend == "process":
+
+            def done(future: concurrent.futures.Future):
+                if not future.cancelled():
+                    music.cover_extracted(cover_path, future.exception())
+
+            future = self.get_pool().submit(
+                extract_video_cover, str(music.realpath), cover_path
+            )
+            future.add_done_callback(done)
+            return
+        with self.condition:
+            job = CoverJob(music, cover_path, priority)
+            heapq.heappush(self.queue, (priority, next(self.counter), job))
+            self.condition.notify()
+        self.start()
+
+    def start(self):
+        amount = self.worker_amount
+        while len(self.threads) < amount:
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(
+        self,
+        music: "MusicData",
+        new_path,
+        priority=CONVERSION_PRIORITY_IMPORT,
+        audio_converting=False,
+    ):
+        music.pending = True
+        music.audio_converting = audio_converting
+        music.load_exc = None
+        with self.condition:
+            self.version += 1
+            self.detach(music)
+            job = self.targets.get(str(new_path), None)
+            if job is not None and not job.cancelled:
+                job.musics.append(music)
+                self.jobs[music] = job
+                if priority < job.priority and not job.running:
+                    job.priority = priority
+                    heapq.heappush(self.queue, (priority, next(self.counter), job))
+                return job
+            job = ConversionJob(
+                music, new_path, priority, next(self.counter), audio_converting
+            )
+            self.jobs[music] = job
+            self.targets[str(new_path)] = job
+            heapq.heappush(self.queue, (priority, next(self.counter), job))
+            self.condition.notify()
+        self.start()
+        return job
+
+    def detach(self, music: "MusicData"):
+        job = self.jobs.pop(music, None)
+        if job is None:
+            return None
+        self.version += 1
+        if music in job.musics:
+            job.musics.remove(music)
+        if len(job.musics) <= 0:
+            job.cancelled = True
+            if self.targets.get(str(job.new_path), None) is job:
+                self.targets.pop(str(job.new_path))
+        return job
+
+    def get_job(self, music: "MusicData"):
+        return self.jobs.get(music, None)
+
+    def cancel(self, music: "MusicData"):
+        with self.condition:
+            return self.detach(music)
+
+    def take_failed(self, playlist: "Playlist"):
+        with self.condition:
+            failed = [music for music in self.failed if music.playlist is playlist]
+            self.failed = [music for music in self.failed if music not in failed]
+        return failed
+
+    def take_finished(self):
+        with self.condition:
+            finished, self.finished = self.finished, []
+            if len(finished) > 0:
+                self.version += 1
+        return finished
+
+    def take_resume(self, realpath):
+        return self.resume.pop(str(realpath), None)
+
+    def load(self):
+        data = load_json(CONVERSIONS_PATH, [])
+        if not isinstance(data, list):
+            return
+        for jdata in data:
+            target = pathlib.Path(jdata["target"])
+            for temp_path in target.parent.glob(f"{target.stem}.part*"):
+                os.remove(temp_path)
+            if jdata.get("audio_converting", False):
+                self.resume[jdata["source"]] = jdata
+
+    def save(self):
+        with self.condition:
+            data = [
+                job.get_save_data()
+                for job in self.targets.values()
+                if not job.cancelled
+            ]
+        Persistence.instance.write(CONVERSIONS_PATH, data + list(self.resume.values()))
+
+    def shutdown(self):
+        with self.condition:
+            for job in self.jobs.values():
+                job.cancelled = True
+                if job.state is not None:
+                    job.state.cancel()
+            self.queue = []
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.shutdown(False, cancel_futures=True)
+            if self.manager is not None:
+                self.manager.shutdown()
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while len(self.queue) <= 0:
+                    self.condition.wait()
+                job: ConversionJob = heapq.heappop(self.queue)[-1]
+                if job.cancelled or job.running:
+                    continue
+                job.running = True
+            if isinstance(job, CoverJob):
+                job.run()
+                continue
+            try:
+                if self.backend == "process":
+                    pool = self.get_pool()
+                    job.run_process(
+                        pool, SharedJobState(self.shared, next(self.counter))
+                    )
+                else:
+                    job.run()
+            except ConversionCancelled:
+                pass
+            except Exception as exc:
+                if not job.cancelled:
+                    for music in job.musics.copy():
+                        music.load_exc = exc
+                    with self.condition:
+                        self.failed.extend(job.musics)
+            else:
+                if not job.cancelled:
+                    with self.condition:
+                        self.finished.extend((music, job) for music in job.musics)
+            with self.condition:
+                self.version += 1
+                for music in job.musics:
+                    if self.jobs.get(music, None) is job:
+                        self.jobs.pop(music)
+                if self.targets.get(str(job.new_path), None) is job:
+                    self.targets.pop(str(job.new_path))
@@ -0,0 +1,148 @@
+import os
+import heapq
+import pygame
+import itertools
+import threading
+from ui.common import COVER_WORKERS, COVER_PRIORITY_VISIBLE, PALETTE_SAMPLE
+from ui.media_cache import COVER_SIZES, thumbnail_path
+
+
+def scale_cover(image: pygame.Surface, size):
+    w, h = image.get_size()
+    ratio = size / max(w, h)
+    if ratio >= 1:
+        return image
+    return pygame.transform.smoothscale(
+        image, (max(1, int(w * ratio)), max(1, int(h * ratio)))
+    )
+
+
+def make_thumbnails(path, image: pygame.Surface):
+    thumbnails = {}
+    for size in COVER_SIZES:
+        thumbnail = scale_cover(image, size)
+        thumb_path = thumbnail_path(path, size)
+        temp_path = thumbnail_path(path, f"{size}.{threading.get_ident()}")
+        pygame.image.save(thumbnail, temp_path)
+        os.replace(temp_path, thumb_path)
+        thumbnails[size] = thumbnail
+    return thumbnails
+
+
+def load_thumbnail(path, size):
+    thumb_path = thumbnail_path(path, size)
+    if os.path.exists(thumb_path) and os.path.getmtime(
+        thumb_path
+    ) >= os.path.getmtime(path):
+        return pygame.image.load(thumb_path).convert_alpha()
+    image = pygame.image.load(path).convert_alpha()
+    if size in COVER_SIZES:
+        return make_thumbnails(path, image)[size]
+    return scale_cover(image, size)
+
+
+def get_palette(image: pygame.Surface):
+    sample = pygame.transform.smoothscale(image, (PALETTE_SAMPLE, PALETTE_SAMPLE))
+    buckets = {}
+    for x in range(PALETTE_SAMPLE):
+        for y in range(PALETTE_SAMPLE):
+            r, g, b, a = sample.get_at((x, y))
+            if a <= 0:
+                continue
+            bucket = buckets.setdefault((r >> 5, g >> 5, b >> 5), [0, 0, 0, 0])
+            bucket[0] += 1
+            bucket[1] += r
+            bucket[2] += g
+            bucket[3] += b
+    if len(buckets) <= 0:
+        return [[0, 0, 0], [0, 0, 0]]
+    colors = [
+        (n, [r // n, g // n, b // n])
+        for n, r, g, b in sorted(buckets.values(), reverse=True)
+    ]
+    dominant = colors[0][1]
+    accent = max(colors, key=lambda item: (max(item[1]) - min(item[1])) * item[0])[1]
+    return [dominant, accent]
+
+
+def load_cover_async(path, obj, size=None, attr="cover"):
+    try:
+        if size is None:
+            cover = pygame.image.load(path).convert_alpha()
+        else:
+            cover = load_thumbnail(path, size)
+    except Exception:
+        cover = None
+    setattr(obj, attr, cover)
+    setattr(obj, f"{attr}_request", None)
+
+
+class CoverLoader:
+    instance: "CoverLoader" = None
+
+    def __init__(self, workers=COVER_WORKERS):
+        self.workers = workers
+        self.threads: list[threading.Thread] = []
+        self.queue = []
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        CoverLoader.instance = self
+
+    @property
+    def queue_depth(self):
+        return len(self.jobs)
+
+    def start(self):
+        if len(self.threads) > 0:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(
+        self,
+        path,
+        obj,
+        priority=COVER_PRIORITY_VISIBLE,
+        tag=None,
+        size=None,
+        attr="cover",
+    ):
+        key = (id(obj), attr)
+        with self.condition:
+            job = self.jobs.get(key, None)
+            if job is not None:
+                if job[0] <= priority:
+                    return
+                job[-1] = False
+            job = [priority, next(self.counter), path, obj, tag, size, attr, True]
+            self.jobs[key] = job
+            heapq.heappush(self.queue, job)
+            self.condition.notify()
+        self.start()
+
+    def cancel(self, tag):
+        with self.condition:
+            for key, job in list(self.jobs.items()):
+                if job[4] is tag and job[-1]:
+                    job[-1] = False
+                    self.jobs.pop(key)
+            self.queue = [job for job in self.queue if job[-1]]
+            heapq.heapify(self.queue)
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while len(self.queue) <= 0:
+                    self.condition.wait()
+                job = heapq.heappop(self.queue)
+                if not job[-1]:
+                    continue
+                job[0] = -1
+            load_cover_async(job[2], job[3], job[5], job[6])
+            with self.condition:
+                key = (id(job[3]), job[6])
+                if self.jobs.get(key, None) is job:
+                    self.jobs.pop(key)
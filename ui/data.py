@@ -1,34 +1,13 @@
-import numpy
 import pygame
 import pathlib
-import threading
 from ui.common import *
-import moviepy.editor as moviepy
-
-
-def load_cover_async(path, obj):
-    obj.cover = pygame.image.load(path).convert_alpha()
-
-
-def get_cover_async(music: "MusicData", videofile: moviepy.VideoClip, cover_path):
-    try:
-        frame: numpy.ndarray = videofile.get_frame(videofile.duration / 2)
-        surface = pygame.image.frombytes(frame.tobytes(), videofile.size, "RGB")
-        pygame.image.save(surface, cover_path)
-        music.cover = surface
-    except Exception:
-        music.cover = None
-
-
-def convert_music_async(music: "MusicData", audiofile: moviepy.AudioClip, new_path):
-    try:
-        audiofile.write_audiofile(str(new_path), verbose=True)
-        music.pending = False
-        if music.audio_converting:
-            music.converted = True
-        music.audio_converting = False
-    except Exception as e:
-        music.load_exc = e
+from ui.metadata import MetadataIndex
+from ui import media_cache
+from ui.media_cache import MediaCache
+from ui.search import SearchIndex
+from ui.durations import DurationScanner
+from ui.cover_loader import CoverLoader, scale_cover, get_palette
+from ui.conversion import ConversionQueue
 
 
 class NotCached: ...
@@ -52,6 +31,13 @@ class MusicData:
         self.realpath = realpath
         self.playlist = playlist
         self.cover = None
+        self.cover_request = None
+        self.cover_file = None
+        self.full_cover = None
+        self.full_cover_request = None
+        self.large_cover = None
+        self.large_cover_request = None
+        self.palette = None
         self.duration = NotCached
         self.pending = False
         self.audio_converting = False
@@ -59,8 +45,8 @@ class MusicData:
         self.converted = converted
         self.group = None
 
-        cover_path = f"data/music_covers/{playlist.name}_{self.realstem}.png"
-        if not os.path.exists(realpath):
+        self.signature = MetadataIndex.signature(realpath)
+        if self.signature is None:
             pygame.display.message_box(
                 "Could not load music",
                 f"Could not load music '{realpath}' as the file doesn't exist anymore. Music will be skipped.",
@@ -69,143 +55,269 @@ class MusicData:
                 ("Understood",),
             )
             return
+        self.cache_key = media_cache.cache_key(realpath, self.signature)
+        cover_path = media_cache.cover_path(self.cache_key)
+
+        metadata = MetadataIndex.instance.get(realpath, playlist.name, self.signature)
+        if (
+            metadata is not None
+            and metadata.get("cached", False)
+            and ("audiopath" in metadata or not (self.isvideo or self.isconvertible))
+        ):
+            if self.load_from_metadata(metadata, cover_path, loading_image):
+                return self
+            MetadataIndex.instance.remove(realpath)
+
+        media_cache.migrate_legacy_files(self.cache_key, playlist.name, self.realstem)
+        self.save_metadata(cached=True)
 
         if self.isvideo:
-            new_path = pathlib.Path(
-                f"data/mp3_converted/{playlist.name}_{self.realstem}.mp3"
-            ).resolve()
+            new_path = self.get_converted_path()
 
             if os.path.exists(new_path) and os.path.exists(cover_path):
-                self.load_cover_async(cover_path, loading_image)
+                self.set_cover_path(cover_path, loading_image)
                 self.audiopath = new_path
+                self.save_metadata(audiopath=str(new_path), cover=True)
                 return self
 
-            videofile = moviepy.VideoFileClip(str(realpath))
-            self.videofile = videofile
-            if not os.path.exists(cover_path):
-                try:
-                    self.pending = True
-                    if loading_image is not None:
-                        self.cover = loading_image
-                    thread = threading.Thread(
-                        target=get_cover_async, args=(self, videofile, cover_path)
-                    )
-                    thread.start()
-                except Exception:
-                    self.cover = None
+            if os.path.exists(cover_path):
+                self.set_cover_path(cover_path, loading_image)
             else:
-                self.load_cover_async(cover_path, loading_image)
-
-            if os.path.exists(new_path):
-                self.audiopath = new_path
-                return self
-
-            audiofile = videofile.audio
-            if audiofile is None:
-                pygame.display.message_box(
-                    "Could not load music",
-                    f"Could not convert '{realpath}' to audio format: the video has no associated audio. Music will be skipped.",
-                    "error",
-                    None,
-                    ("Understood",),
-                )
-                return
+                if loading_image is not None:
+                    self.cover = loading_image
+                ConversionQueue.instance.extract_cover(self, cover_path)
             self.audiopath = new_path
-            self.pending = True
-            thread = threading.Thread(
-                target=convert_music_async, args=(self, audiofile, new_path)
-            )
-            thread.start()
+            if os.path.exists(new_path):
+                self.save_metadata(audiopath=str(new_path))
+            else:
+                ConversionQueue.instance.submit(self, new_path)
             return self
         elif self.isconvertible:
-            new_path = pathlib.Path(
-                f"data/mp3_converted/{playlist.name}_{self.realstem}.mp3"
-            ).resolve()
+            new_path = self.get_converted_path()
 
-            if os.path.exists(cover_path):
-                self.load_cover_async(cover_path, loading_image)
+            has_cover = os.path.exists(cover_path)
+            if has_cover:
+                self.set_cover_path(cover_path, loading_image)
             if os.path.exists(new_path):
                 self.audiopath = new_path
+                self.save_metadata(audiopath=str(new_path), cover=has_cover)
                 return self
 
-            try:
-                audiofile = moviepy.AudioFileClip(str(realpath))
-                self.audiofile = audiofile
-            except Exception as e:
-                pygame.display.message_box(
-                    "Could not load music",
-                    f"Could not convert and load '{realpath}' to Mp3 due to an external exception: '{e}'.",
-                    "error",
-                    None,
-                    ("Understood",),
-                )
-                return
             self.audiopath = new_path
-            self.pending = True
-            thread = threading.Thread(
-                target=convert_music_async, args=(self, audiofile, new_path)
-            )
-            thread.start()
+            ConversionQueue.instance.submit(self, new_path)
             return self
         else:
-            if os.path.exists(cover_path):
-                self.load_cover_async(cover_path, loading_image)
-            if self.converted:
-                self.audiopath = pathlib.Path(
-                    f"data/mp3_converted/{playlist.name}_{self.realstem}.mp3"
-                ).resolve()
-            else:
-                self.audiopath = realpath
+            has_cover = os.path.exists(cover_path)
+            if has_cover:
+                self.set_cover_path(cover_path, loading_image)
+            if self.converted and not os.path.exists(self.get_plain_audiopath()):
+                self.converted = False
+            self.audiopath = self.get_plain_audiopath()
+            self.save_metadata(cover=has_cover)
+            self.resume_conversion()
             return self
 
+    def resume_conversion(self):
+        jdata = ConversionQueue.instance.take_resume(self.realpath)
+        if jdata is None or self.converted:
+            return
+        self.audiopath = pathlib.Path(jdata["target"])
+        ConversionQueue.instance.submit(
+            self, self.audiopath, CONVERSION_PRIORITY_USER, True
+        )
+
+    def conversion_finished(self, job):
+        self.pending = False
+        if self.audio_converting:
+            self.converted = True
+        self.audio_converting = False
+        table = self.playlist.musictable
+        if job.final_path != self.audiopath and table.get(self.audiopath) is self:
+            table.pop(self.audiopath)
+            self.audiopath = job.final_path
+            table[self.audiopath] = self
+            self.playlist.invalidate()
+        self.save_metadata(audiopath=str(self.audiopath))
+
+    def revert_conversion(self):
+        self.audio_converting = False
+        self.pending = False
+        self.load_exc = None
+        self.playlist.musictable.pop(self.audiopath)
+        self.audiopath = self.realpath
+        self.playlist.musictable[self.audiopath] = self
+        self.playlist.invalidate()
+
+    def load_from_metadata(self, metadata, cover_path, loading_image=None):
+        if self.isvideo or self.isconvertible:
+            audiopath = pathlib.Path(metadata["audiopath"])
+        else:
+            audiopath = self.get_plain_audiopath()
+        if audiopath != self.realpath and not os.path.exists(audiopath):
+            return False
+        self.audiopath = audiopath
+        if metadata["duration"] is not None:
+            self.duration = metadata["duration"]
+        if metadata.get("cover", False):
+            self.set_cover_path(cover_path, loading_image)
+        return True
+
+    def get_converted_path(self):
+        path = media_cache.find_converted_path(self.cache_key)
+        if path is None:
+            path = media_cache.converted_path(self.cache_key)
+        return pathlib.Path(path).resolve()
+
+    def get_plain_audiopath(self):
+        if self.converted:
+            return pathlib.Path(media_cache.converted_path(self.cache_key)).resolve()
+        return self.realpath
+
+    def save_metadata(self, **data):
+        if MetadataIndex.instance is None:
+            return
+        MetadataIndex.instance.update(
+            self.realpath, self.signature, self.playlist.name, **data
+        )
+
     def check(self):
-        if not self.pending:
-            if hasattr(self, "audiofile"):
-                self.audiofile.close()
-                del self.audiofile
-            if hasattr(self, "videofile"):
-                self.videofile.close()
-                del self.videofile
         if self.load_exc is None:
             return False
+        load_exc = self.load_exc
         if self.audio_converting:
-            self.audio_converting = False
-            self.pending = False
-            self.load_exc = None
-            self.playlist.musictable.pop(self.audiopath)
-            self.audiopath = self.realpath
-            self.playlist.musictable[self.audiopath] = self
-            pygame.display.message_box(
+            btn = pygame.display.message_box(
                 "Could not convert music",
-                f"Could not convert '{self.realpath}' to MP3 due to external exception: '{self.load_exc}'.",
+                f"Could not convert '{self.realpath}' to MP3 due to external exception: '{load_exc}'.",
                 "error",
                 None,
-                ("Understood",),
+                ("Understood", "Retry"),
             )
+            if btn == 1:
+                ConversionQueue.instance.submit(
+                    self, self.audiopath, CONVERSION_PRIORITY_USER, True
+                )
+            else:
+                self.revert_conversion()
             return False
-        pygame.display.message_box(
+        btn = pygame.display.message_box(
             "Could not load music",
-            f"Could not convert '{self.realpath}' to audio format due to external exception: '{self.load_exc}'. Music will be removed.",
+            f"Could not convert '{self.realpath}' to audio format due to external exception: '{load_exc}'. Music will be removed.",
             "error",
             None,
-            ("Understood",),
+            ("Understood", "Retry"),
         )
+        if btn == 1:
+            ConversionQueue.instance.submit(self, self.audiopath)
+            return False
         self.playlist.remove(self.audiopath)
         return True
 
-    def load_cover_async(self, path, loading_image=None):
+    def cover_extracted(self, cover_path, exc):
+        if exc is not None:
+            self.cover = None
+            return
+        self.set_cover_path(cover_path)
+        self.save_metadata(cover=True)
+        self.reset_palette()
+
+    def set_cover_path(self, path, loading_image=None):
         if loading_image is not None:
             self.cover = loading_image
-        thread = threading.Thread(target=load_cover_async, args=(path, self))
-        thread.start()
+        self.cover_file = path
+        self.cover_request = path
+        self.full_cover = None
+        self.full_cover_request = path
+        self.large_cover = None
+        self.large_cover_request = path
+
+    def set_cover_image(self, surface: pygame.Surface):
+        path = media_cache.cover_path(self.cache_key)
+        pygame.image.save(surface, path)
+        media_cache.remove_thumbnails(self.cache_key)
+        self.cover_file = path
+        self.cover_request = None
+        self.cover = scale_cover(surface, COVER_THUMB_SIZE)
+        self.full_cover = surface
+        self.full_cover_request = None
+        self.large_cover = scale_cover(surface, COVER_LARGE_SIZE)
+        self.large_cover_request = None
+        self.save_metadata(cover=True)
+        self.reset_palette()
+
+    def reset_palette(self):
+        self.palette = None
+        MetadataIndex.instance.update(self.realpath, self.signature, palette=None)
+
+    def get_palette(self):
+        if self.palette is not None or self.cover_file is None:
+            return self.palette
+        entry = MetadataIndex.instance.get_entry(self.realpath, self.signature)
+        if entry is not None and entry.get("palette", None) is not None:
+            self.palette = entry["palette"]
+            return self.palette
+        if self.cover is None or self.cover_request is not None:
+            return None
+        self.palette = get_palette(self.cover)
+        MetadataIndex.instance.update(
+            self.realpath, self.signature, palette=self.palette
+        )
+        return self.palette
 
-    def cache_duration(self):
-        try:
-            soundfile = moviepy.AudioFileClip(str(self.audiopath))
-            self.duration = soundfile.duration
-            soundfile.close()
-        except Exception:
-            self.duration = None
+    def request_cover(self, priority=COVER_PRIORITY_VISIBLE):
+        if self.cover_request is None:
+            return
+        CoverLoader.instance.submit(
+            self.cover_request, self, priority, self.playlist, COVER_THUMB_SIZE
+        )
+
+    def get_full_cover(self):
+        if self.full_cover_request is not None:
+            CoverLoader.instance.submit(
+                self.full_cover_request,
+                self,
+                COVER_PRIORITY_CURRENT,
+                None,
+                None,
+                "full_cover",
+            )
+        if self.full_cover is not None:
+            return self.full_cover
+        return self.cover
+
+    def get_large_cover(self):
+        if self.large_cover_request is not None:
+            CoverLoader.instance.submit(
+                self.large_cover_request,
+                self,
+                COVER_PRIORITY_CURRENT,
+                None,
+                COVER_LARGE_SIZE,
+                "large_cover",
+            )
+        if self.large_cover is not None:
+            return self.large_cover
+        return self.cover
+
+    def release_cover(self, loading_image=None):
+        if self.cover_file is None or self.cover_request is not None:
+            return
+        self.cover = loading_image
+        self.cover_request = self.cover_file
+
+    def release_full_cover(self):
+        self.full_cover = None
+        self.full_cover_request = self.cover_file
+        self.large_cover = None
+        self.large_cover_request = self.cover_file
+
+    def request_duration(self, priority=DURATION_PRIORITY_LOADED):
+        if self.duration is not NotCached:
+            return
+        entry = MetadataIndex.instance.get_entry(self.realpath, self.signature)
+        if entry is not None and "duration" in entry:
+            self.duration = entry["duration"]
+            return
+        DurationScanner.instance.submit(self.realpath, priority, self)
 
     def cover_or(self, default):
         if self.cover is None:
@@ -238,8 +350,12 @@ class MusicData:
 
 
 class HistoryData:
-    def __init__(self, music: MusicData, position, duration):
+    def __init__(
+        self, music: MusicData, position, duration, playlist=None, realpath=None
+    ):
         self.music = music
+        self.playlist: "Playlist" = playlist if music is None else music.playlist
+        self.realpath = realpath if music is None else music.realpath
         self.position = position
         if duration is NotCached:
             duration = "not cached"
@@ -248,32 +364,52 @@ class HistoryData:
             if int(self.position) >= int(self.duration - 0.01):
                 self.position = 0
 
+    @property
+    def key(self):
+        return HistoryData.get_key(self.playlist, self.realpath)
+
+    @staticmethod
+    def get_key(playlist: "Playlist", realpath):
+        return playlist, str(realpath)
+
+    def resolve(self):
+        if self.music is not None:
+            return True
+        self.playlist.load()
+        music = self.playlist.realpath_table.get(self.realpath, None)
+        if music is None:
+            music = self.playlist.musictable.get(self.realpath, None)
+        if music is None:
+            return False
+        self.realpath = music.realpath
+        if self.duration is not None and self.duration != "not cached":
+            music.duration = self.duration
+        self.music = music
+        return True
+
     def get_save_data(self):
         duration = self.duration
         if duration is NotCached:
             duration = "not cached"
         return {
-            "audiopath": str(self.music.audiopath),
+            "audiopath": str(self.realpath),
             "position": self.position,
-            "playlist": self.music.playlist.name,
+            "playlist": self.playlist.name,
             "duration": duration,
         }
 
     @classmethod
-    def load_from_data(self, data: dict, app: "MusicPlayerApp"):
-        playlist = None
-        for pobj in app.playlists:
-            if pobj.name == data["playlist"]:
-                playlist = pobj
-                break
+    def load_from_data(self, data: dict, playlists: dict[str, "Playlist"]):
+        playlist = playlists.get(data["playlist"], None)
         if playlist is None:
             return
-        musicobj = playlist.musictable.get(pathlib.Path(data["audiopath"]), None)
-        if musicobj is None:
-            return
-        if data["duration"] is not None and data["duration"] != "not cached":
-            musicobj.duration = data["duration"]
-        return HistoryData(musicobj, data["position"], data["duration"])
+        return HistoryData(
+            None,
+            data["position"],
+            data["duration"],
+            playlist,
+            pathlib.Path(data["audiopath"]),
+        )
 
 
 class PlaylistGroup:
@@ -309,6 +445,7 @@ class PlaylistGroup:
         music.group = None
         music.playlist.musiclist.remove(music)
         music.playlist.musiclist.insert(self.idx, music)
+        music.playlist.invalidate()
 
 
 class Playlist:
@@ -317,23 +454,69 @@ class Playlist:
         self.cover = None
         if groups_data is None:
             groups_data = []
+        self.filepaths = filepaths
+        self.groups_data = groups_data
+        self.loading_image = loading_image
+        self.loaded = False
+        self.cover_request = None
         self.groups: list[PlaylistGroup] = []
+        self.musiclist: list[MusicData] = []
+        self.musictable: dict[pathlib.Path, MusicData] = {}
+        self.version = 0
+        self.order_version = -1
+        self.order_cache = {}
+        self.positions: dict[MusicData, int] = {}
+        self.realpath_table: dict[pathlib.Path, MusicData] = {}
+        self.search_index: SearchIndex = None
+        for path in self.realpaths:
+            MediaCache.instance.acquire(path)
 
         if os.path.exists(f"data/covers/{self.name}.png"):
             if loading_image is not None:
                 self.cover = loading_image
-            thread = threading.Thread(
-                target=load_cover_async,
-                args=(f"data/covers/{self.name}.png", self),
-            )
-            thread.start()
+            self.cover_request = f"data/covers/{self.name}.png"
 
-        self.musiclist: list[MusicData] = []
-        self.musictable: dict[pathlib.Path, MusicData] = {}
-        for path in filepaths:
-            self.load_music(path, loading_image)
+    def request_cover(self, priority=COVER_PRIORITY_VISIBLE):
+        if self.cover_request is None:
+            return
+        CoverLoader.instance.submit(self.cover_request, self, priority)
+
+    def prefetch_covers(self, musics):
+        for music in musics:
+            music.request_cover(COVER_PRIORITY_PREFETCH)
+
+    def cancel_covers(self):
+        CoverLoader.instance.cancel(self)
 
+    def release_covers(self, keep=None):
+        self.cancel_covers()
+        for music in self.musiclist:
+            if music is not keep:
+                music.release_cover(self.loading_image)
+
+    def release_cache(self):
+        for path in self.realpaths:
+            MediaCache.instance.release(path)
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        for path in self.filepaths:
+            MediaCache.instance.release(path[0] if isinstance(path, list) else path)
+        for path in self.filepaths:
+            self.load_music(path, self.loading_image)
+
+        groups_data = self.groups_data
         if len(groups_data) > 0 and isinstance(groups_data[0], PlaylistGroup):
+            for group in groups_data:
+                group.musics = [
+                    self.realpath_table[music.realpath]
+                    for music in group.musics
+                    if music.realpath in self.realpath_table
+                ]
+                for music in group.musics:
+                    music.group = group
             self.groups = groups_data
         else:
             for gdata in groups_data:
@@ -344,18 +527,91 @@ class Playlist:
                         [
                             self.musictable[pathlib.Path(gdpath)]
                             for gdpath in gdata["paths"]
+                            if pathlib.Path(gdpath) in self.musictable
                         ],
                         gdata.get("idx", 0),
                         gdata.get("collapsed", True),
                         gdata.get("mode", "h"),
                     )
                 )
+        self.filepaths = []
+        self.groups_data = []
+        self.invalidate()
+
+    def invalidate(self):
+        self.version += 1
+
+    def check_order_cache(self):
+        if self.order_version == self.version:
+            return
+        self.order_version = self.version
+        self.order_cache = {}
+        self.positions = {}
 
     @property
     def realpaths(self):
+        if not self.loaded:
+            return [
+                path[0] if isinstance(path, list) else path for path in self.filepaths
+            ]
         return [music.realpath for music in self.musiclist]
 
+    @property
+    def track_count(self):
+        if not self.loaded:
+            return len(self.filepaths)
+        return len(self.musiclist)
+
+    def get_save_data(self):
+        if not self.loaded:
+            return {
+                "name": self.name,
+                "paths": [
+                    [str(path[0]), "converted"]
+                    if isinstance(path, list)
+                    else str(path)
+                    for path in self.filepaths
+                ],
+                "groups": self.groups_data,
+            }
+        return {
+            "name": self.name,
+            "paths": [
+                [str(m.realpath), "converted"] if m.converted else str(m.realpath)
+                for m in self.musiclist
+            ],
+            "groups": [group.get_save_data() for group in self.groups],
+        }
+
     def get_group_sorted_musics(self, paths=False, groups=False):
+        self.check_order_cache()
+        order = self.order_cache.get((paths, groups), None)
+        if order is None:
+            order = self.sort_group_musics(paths, groups)
+            self.order_cache[(paths, groups)] = order
+        return order
+
+    def index_of(self, music: MusicData):
+        self.check_order_cache()
+        if len(self.positions) <= 0:
+            self.positions = {
+                music: i for i, music in enumerate(self.get_group_sorted_musics())
+            }
+        return self.positions[music]
+
+    def get_search_index(self):
+        if self.search_index is None:
+            self.search_index = SearchIndex()
+            for music in self.musiclist:
+                self.search_index.add(music, music.realstem)
+        return self.search_index
+
+    def has_realpath(self, path):
+        if not self.loaded:
+            return path in self.realpaths
+        return path in self.realpath_table
+
+    def sort_group_musics(self, paths=False, groups=False):
         ungrouped_musics = [
             (music.audiopath if paths else music)
             for music in self.musiclist
@@ -367,24 +623,22 @@ class Playlist:
                 if len(group.musics) > 0:
                     ungrouped_musics.insert(group.idx, group)
             elif len(group.musics) > 0:
-                ungrouped_musics = (
-                    ungrouped_musics[: group.idx + i_offset]
-                    + (
-                        [music.audiopath for music in group.musics]
-                        if paths
-                        else group.musics
-                    )
-                    + ungrouped_musics[group.idx + i_offset :]
+                pos = group.idx + i_offset
+                ungrouped_musics[pos:pos] = (
+                    [music.audiopath for music in group.musics]
+                    if paths
+                    else group.musics
                 )
                 i_offset += len(group.musics) - 1
         return ungrouped_musics
 
     def load_music(self, path, loading_image=None, idx=-1):
+        self.load()
         converted = False
         if isinstance(path, list):
             path = path[0]
             converted = True
-        if path in self.musictable or path in self.realpaths:
+        if path in self.musictable or self.has_realpath(path):
             return
         music_data = MusicData.load(path, self, loading_image, converted)
         if music_data is None:
@@ -394,9 +648,20 @@ class Playlist:
         else:
             self.musiclist.append(music_data)
         self.musictable[music_data.audiopath] = music_data
+        self.realpath_table[music_data.realpath] = music_data
+        MediaCache.instance.acquire(music_data.realpath)
+        music_data.request_duration()
+        if self.search_index is not None:
+            self.search_index.add(music_data, music_data.realstem)
+        self.invalidate()
 
     def remove(self, path):
         music = self.musictable.pop(path)
         self.musiclist.remove(music)
+        self.realpath_table.pop(music.realpath, None)
+        MediaCache.instance.release(music.realpath)
+        if self.search_index is not None:
+            self.search_index.remove(music)
+        self.invalidate()
         if music.group is not None:
             music.group.remove(music)
@@ -0,0 +1,117 @@
+import time
+import wave
+import heapq
+import itertools
+import threading
+import moviepy.editor as moviepy
+from ui.common import *
+from ui.metadata import MetadataIndex
+from ui.conversion import probe_duration
+
+try:
+    import mutagen
+except (ImportError, ModuleNotFoundError):
+    mutagen = None
+
+
+def read_duration(path):
+    if mutagen is not None:
+        try:
+            info = mutagen.File(path)
+            if info is not None and info.info.length > 0:
+                return info.info.length
+        except Exception:
+            pass
+    if path.suffix.lower() == ".wav":
+        try:
+            with wave.open(str(path)) as file:
+                return file.getnframes() / file.getframerate()
+        except Exception:
+            pass
+    duration = probe_duration(path)
+    if duration is not None:
+        return duration
+    soundfile = moviepy.AudioFileClip(str(path))
+    try:
+        return soundfile.duration
+    finally:
+        soundfile.close()
+
+
+class DurationScanner:
+    instance: "DurationScanner" = None
+
+    def __init__(self):
+        self.thread: threading.Thread = None
+        self.queue = []
+        self.jobs: dict[str, list] = {}
+        self.listeners: dict[str, list["MusicData"]] = {}
+        self.results = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        DurationScanner.instance = self
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def submit(self, realpath, priority=DURATION_PRIORITY_SCAN, music=None):
+        key = str(realpath)
+        with self.condition:
+            if music is not None:
+                listeners = self.listeners.setdefault(key, [])
+                if music not in listeners:
+                    listeners.append(music)
+            job = self.jobs.get(key, None)
+            if job is not None:
+                if job[0] <= priority:
+                    return
+                job[-1] = False
+            job = [priority, next(self.counter), realpath, True]
+            self.jobs[key] = job
+            heapq.heappush(self.queue, job)
+            self.condition.notify()
+        self.start()
+
+    def scan_library(self, playlists: list["Playlist"]):
+        entries = MetadataIndex.instance.entries
+        for playlist in playlists:
+            for path in playlist.realpaths:
+                entry = entries.get(str(path), None)
+                if entry is None or "duration" not in entry:
+                    self.submit(path)
+
+    def apply(self):
+        with self.condition:
+            results, self.results = self.results, []
+            listeners = [self.listeners.pop(str(result[0]), []) for result in results]
+        for (realpath, signature, duration), musics in zip(results, listeners):
+            MetadataIndex.instance.update(realpath, signature, duration=duration)
+            for music in musics:
+                music.duration = duration
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while len(self.queue) <= 0:
+                    self.condition.wait()
+                job = heapq.heappop(self.queue)
+                if not job[-1]:
+                    continue
+            realpath = job[2]
+            signature = MetadataIndex.signature(realpath)
+            duration = None
+            if signature is not None:
+                try:
+                    duration = read_duration(realpath)
+                except Exception:
+                    duration = None
+            with self.condition:
+                key = str(realpath)
+                if self.jobs.get(key, None) is job:
+                    self.jobs.pop(key)
+                self.results.append((realpath, signature, duration))
+            if job[0] >= DURATION_PRIORITY_SCAN:
+                time.sleep(DURATION_SCAN_DELAY)
@@ -0,0 +1,202 @@
+import mili
+import pygame
+from ui.common import *
+from ui.data import Playlist
+from ui.search import LibraryIndex
+from ui.entryline import UIEntryline
+
+
+class GlobalSearchUI(UIComponent):
+    def init(self):
+        self.anim_close = animation(-5)
+        self.cache = mili.ImageCache()
+        self.scroll = mili.Scroll()
+        self.scrollbar = mili.Scrollbar(self.scroll, 7, 0, 0, 0, "y")
+        self.sbar_size = self.scrollbar.short_size
+        self.entryline = UIEntryline("Search every playlist...", False)
+        self.library = LibraryIndex()
+        self.results_key = None
+        self.results = []
+
+    def get_results(self):
+        query = self.entryline.text.strip()
+        if query == "":
+            return []
+        key = (self.library.index.version, query)
+        if key != self.results_key:
+            self.results = self.library.top(
+                query, GLOBAL_SEARCH_LIMIT, self.app.playlists
+            )
+            self.results_key = key
+        return self.results
+
+    def ui(self):
+        self.mili.id_checkpoint(3000 + 700)
+        self.library.sync(self.app.playlists)
+        handle_arrow_scroll(self.app, self.scroll, self.scrollbar)
+
+        with self.mili.begin(
+            ((0, 0), self.app.window.size), {"ignore_grid": True} | mili.CENTER
+        ):
+            self.mili.image(
+                SURF, {"fill": True, "fill_color": (0, 0, 0, 200), "cache": self.cache}
+            )
+
+            with self.mili.begin(
+                (0, 0, 0, 0),
+                {
+                    "fillx": "90",
+                    "filly": "75",
+                    "align": "center",
+                    "spacing": self.mult(13),
+                    "offset": (
+                        0,
+                        -self.mult(50) * (self.app.music is not None)
+                        - self.app.tbarh / 2,
+                    ),
+                },
+            ):
+                self.mili.rect({"color": (MODAL_CV,) * 3, "border_radius": "5"})
+
+                self.ui_modal_content()
+
+            self.ui_overlay_btn(
+                self.anim_close, self.close, self.app.close_image, tooltip="Close"
+            )
+
+    def ui_modal_content(self):
+        self.mili.text_element("Search", {"size": self.mult(26)}, None, mili.CENTER)
+        self.entryline.update(self.app)
+        self.entryline.ui(
+            self.mili,
+            (0, 0, 0, self.mult(35)),
+            {"fillx": "98", "align": "center"},
+            self.mult,
+        )
+        results = self.get_results()
+        with self.mili.begin(
+            None,
+            {"fillx": True, "filly": True} | mili.PADLESS,
+        ) as cont:
+            self.scroll.update(cont)
+            self.scrollbar.short_size = self.mult(self.sbar_size)
+            self.scrollbar.update(cont)
+            for playlist, path in results:
+                self.ui_result(playlist, path)
+            if len(results) <= 0:
+                self.mili.text_element(
+                    "Indexing library..."
+                    if self.library.indexing
+                    else "No matching tracks",
+                    {"size": self.mult(20), "color": (200,) * 3},
+                    None,
+                    {"align": "center"},
+                )
+            self.ui_scrollbar()
+        self.mili.element((0, 0, 0, self.mult(4)))
+
+    def ui_scrollbar(self):
+        if self.scrollbar.needed:
+            with self.mili.begin(self.scrollbar.bar_rect, self.scrollbar.bar_style):
+                self.mili.rect({"color": (BSBAR_CV,) * 3})
+                if handle := self.mili.element(
+                    self.scrollbar.handle_rect, self.scrollbar.handle_style
+                ):
+                    self.mili.rect(
+                        {"color": (cond(self.app, handle, *SHANDLE_CV) * 1.2,) * 3}
+                    )
+                    self.scrollbar.update_handle(handle)
+                    if (
+                        handle.hovered or handle.unhover_pressed
+                    ) and self.app.can_interact():
+                        self.app.cursor_hover = True
+                        self.app.tick_tooltip(None)
+
+    def ui_result(self, playlist: Playlist, path):
+        with self.mili.begin(
+            (0, 0, 0, 0),
+            {
+                "fillx": "97" if self.scrollbar.needed else "99",
+                "resizey": True,
+                "anchor": "first",
+                "offset": (
+                    self.scrollbar.needed * -self.mult(self.sbar_size / 2),
+                    self.scroll.get_offset()[1],
+                ),
+                "pady": 2,
+                "spacing": 0,
+                "align": "center",
+            },
+        ) as it:
+            self.mili.rect({"color": (cond(self.app, it, *MENUB_CV),) * 3})
+            self.mili.text_element(
+                parse_music_stem(self.app, path.stem),
+                {
+                    "size": self.mult(16),
+                    "growx": False,
+                    "wraplen": "100",
+                    "font_align": pygame.FONT_LEFT,
+                    "align": "topleft",
+                },
+                None,
+                {"align": "first", "blocking": False, "fillx": True},
+            )
+            self.mili.text_element(
+                playlist.name,
+                {
+                    "size": self.mult(13),
+                    "color": (120,) * 3,
+                    "growx": False,
+                    "font_align": pygame.FONT_LEFT,
+                    "align": "topleft",
+                },
+                None,
+                {"align": "first", "blocking": False, "fillx": True},
+            )
+
+            if self.app.can_interact():
+                if it.left_just_released:
+                    self.jump_to(playlist, path)
+                if it.hovered or it.unhover_pressed:
+                    self.app.cursor_hover = True
+                if it.hovered:
+                    self.app.tick_tooltip("Open the playlist and play the track")
+
+    def jump_to(self, playlist: Playlist, path):
+        viewer = self.app.playlist_viewer
+        viewer.modal_state = "none"
+        viewer.stop_searching()
+        viewer.enter(playlist)
+        music = next(
+            (music for music in playlist.musiclist if music.realpath == path), None
+        )
+        self.close()
+        if music is None or music.pending:
+            return
+        self.app.play_music(music, playlist.index_of(music))
+        viewer.set_scroll_to_music()
+
+    def open(self):
+        self.app.close_menu()
+        self.app.modal_state = "global_search"
+
+    def close(self):
+        self.entryline.text = ""
+        self.entryline.cursor = 0
+        self.app.modal_state = "none"
+
+    def event(self, event):
+        if self.app.listening_key:
+            return False
+        if event.type == pygame.MOUSEWHEEL:
+            handle_wheel_scroll(event, self.app, self.scroll, self.scrollbar)
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            self.close()
+            return True
+        if Keybinds.check("confirm", event, ignore_input=True):
+            results = self.get_results()
+            if len(results) > 0:
+                self.jump_to(*results[0])
+            return True
+        self.entryline.event(event)
+        return True
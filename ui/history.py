@@ -1,7 +1,8 @@
 import mili
 import pygame
+import itertools
 from ui.common import *
-from ui.data import HistoryData
+from ui.data import HistoryData, NotCached
 
 
 class HistoryUI(UIComponent):
@@ -64,16 +65,42 @@ class HistoryUI(UIComponent):
                 30,
                 tooltip="Clear the history",
             )
+        spacing = self.mult(3)
         with self.mili.begin(
             None,
-            {"fillx": True, "filly": True} | mili.PADLESS,
+            {"fillx": True, "filly": True} | mili.PADLESS | {"spacing": spacing},
         ) as cont:
             self.scroll.update(cont)
             self.scrollbar.short_size = self.mult(self.sbar_size)
             self.scrollbar.update(cont)
-            for history in reversed(self.app.history_data):
+            history_data = self.app.history_data
+            stride = self.get_row_height() + spacing
+            top = -self.scroll.get_offset()[1]
+            start = max(0, int(top // stride) - 1)
+            end = min(
+                len(history_data), int((top + self.app.window.size[1]) // stride) + 2
+            )
+            if start > 0:
+                self.mili.element((0, 0, 0, start * stride - spacing))
+            missing = []
+            rekey = False
+            for key, history in itertools.islice(
+                reversed(history_data.items()), start, end
+            ):
+                if not history.resolve():
+                    missing.append(key)
+                    continue
+                rekey = rekey or history.key != key
                 self.ui_history(history)
-            if len(self.app.history_data) <= 0:
+            for key in missing:
+                history_data.pop(key, None)
+            if rekey:
+                self.app.rekey_history()
+            if end < len(history_data):
+                self.mili.element(
+                    (0, 0, 0, (len(history_data) - end) * stride - spacing)
+                )
+            if len(history_data) <= 0:
                 self.mili.text_element(
                     "No music in history",
                     {"size": self.mult(20), "color": (200,) * 3},
@@ -102,13 +129,14 @@ class HistoryUI(UIComponent):
 
     def ui_history(self, history: HistoryData):
         if history.duration == "not cached" and history.music.pos_supported:
-            history.music.cache_duration()
-            history.duration = history.music.duration
+            if history.music.duration is NotCached:
+                history.music.request_duration()
+            else:
+                history.duration = history.music.duration
         with self.mili.begin(
-            (0, 0, 0, 0),
+            (0, 0, 0, self.get_row_height()),
             {
                 "fillx": "97" if self.scrollbar.needed else "99",
-                "resizey": True,
                 "anchor": "first",
                 "offset": (
                     self.scrollbar.needed * -self.mult(self.sbar_size / 2),
@@ -131,8 +159,14 @@ class HistoryUI(UIComponent):
                 if it.hovered:
                     self.app.tick_tooltip("Restore track at position")
 
+    def get_row_height(self):
+        return self.mult(62) + 4
+
     def ui_history_time(self, history: HistoryData, cont_rect):
-        if history.music.pos_supported:
+        if history.music.pos_supported and history.duration not in [
+            None,
+            "not cached",
+        ]:
             data = self.mili.line_element(
                 [("-49.5", 0), ("49.5", 0)],
                 {"color": (120,) * 3, "size": self.mult(2)},
@@ -161,6 +195,7 @@ class HistoryUI(UIComponent):
             )
 
     def ui_history_title(self, history: HistoryData):
+        history.music.request_cover()
         cover = history.music.cover
         if cover is None:
             cover = self.app.music_cover_image
@@ -193,14 +228,14 @@ class HistoryUI(UIComponent):
         self.app.playlist_viewer.enter(history.music.playlist)
         self.app.play_music(
             history.music,
-            history.music.playlist.get_group_sorted_musics().index(history.music),
+            history.music.playlist.index_of(history.music),
         )
         self.app.set_music_pos(history.position)
         self.app.playlist_viewer.set_scroll_to_music()
         self.app.modal_state = "none"
 
     def action_clear(self):
-        self.app.history_data = []
+        self.app.history_data.clear()
 
     def back(self):
         self.app.modal_state = "settings"
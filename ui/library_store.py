@@ -0,0 +1,343 @@
+import os
+import json
+import sqlite3
+import threading
+from ui.common import *
+from ui.persistence import Persistence
+
+MIGRATIONS = [
+    [
+        """CREATE TABLE tracks (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE
+        )""",
+        """CREATE TABLE playlists (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            position INTEGER NOT NULL
+        )""",
+        """CREATE TABLE playlist_tracks (
+            playlist_id INTEGER NOT NULL REFERENCES playlists(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            track_id INTEGER NOT NULL REFERENCES tracks(id),
+            converted INTEGER NOT NULL,
+            PRIMARY KEY (playlist_id, position)
+        )""",
+        """CREATE TABLE playlist_groups (
+            id INTEGER PRIMARY KEY,
+            playlist_id INTEGER NOT NULL REFERENCES playlists(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            collapsed INTEGER NOT NULL,
+            mode TEXT NOT NULL
+        )""",
+        "CREATE INDEX playlist_groups_playlist ON playlist_groups (playlist_id)",
+        """CREATE TABLE group_tracks (
+            group_id INTEGER NOT NULL REFERENCES playlist_groups(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            track_id INTEGER NOT NULL REFERENCES tracks(id),
+            PRIMARY KEY (group_id, position)
+        )""",
+        """CREATE TABLE history (
+            position INTEGER PRIMARY KEY,
+            playlist TEXT NOT NULL,
+            audiopath TEXT NOT NULL,
+            time REAL NOT NULL,
+            duration TEXT NOT NULL
+        )""",
+        """CREATE TABLE metadata (
+            path TEXT PRIMARY KEY,
+            entry TEXT NOT NULL
+        )""",
+    ],
+]
+
+
+class LibraryStore:
+    instance: "LibraryStore" = None
+
+    def __init__(self):
+        self.connection: sqlite3.Connection = None
+        self.lock = threading.Lock()
+        self.written: dict[str, dict] = {}
+        self.track_ids: dict[str, int] = {}
+        self.pending_metadata: dict[str, str] = {}
+        LibraryStore.instance = self
+
+    @property
+    def active(self):
+        return self.connection is not None
+
+    def open(self):
+        try:
+            self.connection = sqlite3.connect(
+                LIBRARY_DB_PATH, check_same_thread=False, isolation_level=None
+            )
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+            self.connection.execute("PRAGMA foreign_keys = ON")
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            if version < len(MIGRATIONS):
+                self.transaction(self.migrate, version)
+        except (sqlite3.Error, OSError, ValueError, KeyError, TypeError) as exc:
+            print(f"Could not open '{LIBRARY_DB_PATH}', using the JSON files: {exc}")
+            self.close()
+            return False
+        return True
+
+    def close(self):
+        if self.connection is None:
+            return
+        with self.lock:
+            self.connection.close()
+            self.connection = None
+
+    def transaction(self, func, *args):
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                func(*args)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                self.written = {}
+                self.track_ids = {}
+                raise
+
+    def migrate(self, version):
+        for statements in MIGRATIONS[version:]:
+            for statement in statements:
+                self.connection.execute(statement)
+        if version == 0:
+            self.import_json()
+        self.connection.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+    def import_json(self):
+        persistence = Persistence.instance
+        if os.path.exists("data/playlists.json"):
+            self.store_playlists(persistence.load("data/playlists.json", []))
+        if os.path.exists("data/history.json"):
+            self.store_history(persistence.load("data/history.json", []))
+        if os.path.exists(METADATA_PATH):
+            entries = persistence.load(METADATA_PATH, {})
+            if isinstance(entries, dict):
+                self.store_metadata(
+                    {key: dump_json(entry) for key, entry in entries.items()}
+                )
+        print(f"Imported the JSON library into '{LIBRARY_DB_PATH}'")
+
+    def get_track_id(self, path):
+        track_id = self.track_ids.get(path, None)
+        if track_id is not None:
+            return track_id
+        self.connection.execute(
+            "INSERT OR IGNORE INTO tracks (path) VALUES (?)", (path,)
+        )
+        track_id = self.connection.execute(
+            "SELECT id FROM tracks WHERE path = ?", (path,)
+        ).fetchone()[0]
+        self.track_ids[path] = track_id
+        return track_id
+
+    def load_playlists(self):
+        data = []
+        with self.lock:
+            playlists = self.connection.execute(
+                "SELECT id, name FROM playlists ORDER BY position"
+            ).fetchall()
+            for playlist_id, name in playlists:
+                paths = [
+                    [path, "converted"] if converted else path
+                    for path, converted in self.connection.execute(
+                        "SELECT tracks.path, playlist_tracks.converted "
+                        "FROM playlist_tracks JOIN tracks ON tracks.id = playlist_tracks.track_id "
+                        "WHERE playlist_tracks.playlist_id = ? ORDER BY playlist_tracks.position",
+                        (playlist_id,),
+                    )
+                ]
+                groups = []
+                for group_id, gname, idx, collapsed, mode in self.connection.execute(
+                    "SELECT id, name, idx, collapsed, mode FROM playlist_groups "
+                    "WHERE playlist_id = ? ORDER BY position",
+                    (playlist_id,),
+                ).fetchall():
+                    gpaths = [
+                        row[0]
+                        for row in self.connection.execute(
+                            "SELECT tracks.path FROM group_tracks JOIN tracks ON tracks.id = group_tracks.track_id "
+                            "WHERE group_tracks.group_id = ? ORDER BY group_tracks.position",
+                            (group_id,),
+                        )
+                    ]
+                    groups.append(
+                        {
+                            "name": gname,
+                            "idx": idx,
+                            "collapsed": bool(collapsed),
+                            "mode": mode,
+                            "paths": gpaths,
+                        }
+                    )
+                pdata = {"name": name, "paths": paths, "groups": groups}
+                self.written[name] = pdata
+                data.append(pdata)
+        Persistence.instance.snapshots["library:playlists"] = data
+        return data
+
+    def load_history(self):
+        with self.lock:
+            data = [
+                {
+                    "audiopath": audiopath,
+                    "position": position,
+                    "playlist": playlist,
+                    "duration": json.loads(duration),
+                }
+                for playlist, audiopath, position, duration in self.connection.execute(
+                    "SELECT playlist, audiopath, time, duration FROM history ORDER BY position"
+                )
+            ]
+        Persistence.instance.snapshots["library:history"] = data
+        return data
+
+    def load_metadata(self):
+        with self.lock:
+            return {
+                path: parse_json(entry)
+                for path, entry in self.connection.execute(
+                    "SELECT path, entry FROM metadata"
+                )
+            }
+
+    def save(self, playlist_data, history_data):
+        persistence = Persistence.instance
+        if persistence.changed("library:playlists", playlist_data):
+            persistence.submit(
+                "library:playlists", self.write_playlists, playlist_data
+            )
+        if persistence.changed("library:history", history_data):
+            persistence.submit("library:history", self.write_history, history_data)
+
+    def save_metadata(self, changes):
+        with self.lock:
+            self.pending_metadata.update(changes)
+        Persistence.instance.submit("library:metadata", self.flush_metadata)
+
+    def flush_metadata(self):
+        with self.lock:
+            changes, self.pending_metadata = self.pending_metadata, {}
+        self.write_metadata(changes)
+
+    def write_playlist_content(self, playlist_id, pdata):
+        self.connection.execute(
+            "DELETE FROM playlist_tracks WHERE playlist_id = ?", (playlist_id,)
+        )
+        self.connection.execute(
+            "DELETE FROM playlist_groups WHERE playlist_id = ?", (playlist_id,)
+        )
+        self.connection.executemany(
+            "INSERT INTO playlist_tracks (playlist_id, position, track_id, converted) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (
+                    playlist_id,
+                    position,
+                    self.get_track_id(path if isinstance(path, str) else path[0]),
+                    not isinstance(path, str),
+                )
+                for position, path in enumerate(pdata["paths"])
+            ],
+        )
+        for position, group in enumerate(pdata.get("groups", [])):
+            group_id = self.connection.execute(
+                "INSERT INTO playlist_groups (playlist_id, position, name, idx, collapsed, mode) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    playlist_id,
+                    position,
+                    group["name"],
+                    group.get("idx", 0),
+                    group.get("collapsed", True),
+                    group.get("mode", "h"),
+                ),
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT INTO group_tracks (group_id, position, track_id) VALUES (?, ?, ?)",
+                [
+                    (group_id, gposition, self.get_track_id(path))
+                    for gposition, path in enumerate(group["paths"])
+                ],
+            )
+
+    def write_playlists(self, playlist_data):
+        self.transaction(self.store_playlists, playlist_data)
+
+    def store_playlists(self, playlist_data):
+        changed = False
+        names = {pdata["name"] for pdata in playlist_data}
+        stored = dict(self.connection.execute("SELECT name, id FROM playlists"))
+        for name, playlist_id in stored.items():
+            if name not in names:
+                self.connection.execute(
+                    "DELETE FROM playlists WHERE id = ?", (playlist_id,)
+                )
+                self.written.pop(name, None)
+                changed = True
+        for position, pdata in enumerate(playlist_data):
+            name = pdata["name"]
+            playlist_id = stored.get(name, None)
+            if playlist_id is None:
+                playlist_id = self.connection.execute(
+                    "INSERT INTO playlists (name, position) VALUES (?, ?)",
+                    (name, position),
+                ).lastrowid
+            else:
+                self.connection.execute(
+                    "UPDATE playlists SET position = ? WHERE id = ?",
+                    (position, playlist_id),
+                )
+                if self.written.get(name, None) == pdata:
+                    continue
+            self.write_playlist_content(playlist_id, pdata)
+            self.written[name] = pdata
+            changed = True
+        if changed:
+            self.connection.execute(
+                "DELETE FROM tracks WHERE id NOT IN (SELECT track_id FROM playlist_tracks) "
+                "AND id NOT IN (SELECT track_id FROM group_tracks)"
+            )
+            self.track_ids = {}
+
+    def write_history(self, history_data):
+        self.transaction(self.store_history, history_data)
+
+    def store_history(self, history_data):
+        self.connection.execute("DELETE FROM history")
+        self.connection.executemany(
+            "INSERT INTO history (position, playlist, audiopath, time, duration) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    position,
+                    hdata["playlist"],
+                    hdata["audiopath"],
+                    hdata["position"],
+                    json.dumps(hdata.get("duration", None)),
+                )
+                for position, hdata in enumerate(history_data)
+            ],
+        )
+
+    def write_metadata(self, changes):
+        self.transaction(self.store_metadata, changes)
+
+    def store_metadata(self, changes):
+        self.connection.executemany(
+            "DELETE FROM metadata WHERE path = ?",
+            [(key,) for key, text in changes.items() if text is None],
+        )
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO metadata (path, entry) VALUES (?, ?)",
+            [(key, text) for key, text in changes.items() if text is not None],
+        )
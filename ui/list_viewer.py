@@ -135,6 +135,7 @@ class ListViewerUI(UIComponent):
 
             imagesize = self.mult(70)
             padsize = 0
+            playlist.request_cover()
             cover = playlist.cover
             if cover is None:
                 cover = self.app.playlist_cover
@@ -252,8 +253,9 @@ class ListViewerUI(UIComponent):
             for music in self.app.menu_data.musiclist:
                 if music is self.app.music:
                     self.app.end_music()
-                self.app.remove_from_history(music)
+            self.app.remove_playlist_from_history(self.app.menu_data)
             self.app.playlists.remove(self.app.menu_data)
+            self.app.menu_data.release_cache()
         except Exception:
             pass
         self.app.close_menu()
@@ -0,0 +1,106 @@
+import os
+import hashlib
+
+CONVERTED_FOLDER = "data/mp3_converted"
+COVERS_FOLDER = "data/music_covers"
+CONVERTED_EXTENSIONS = ["mp3", "ogg"]
+COVER_SIZES = (64, 128, 512)
+KEY_LENGTH = 24
+
+
+def cache_key(realpath, signature=None):
+    if signature is None:
+        try:
+            stat = os.stat(realpath)
+        except OSError:
+            return None
+        signature = [stat.st_mtime_ns, stat.st_size]
+    data = f"{realpath}|{signature[0]}|{signature[1]}"
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:KEY_LENGTH]
+
+
+def is_cache_file(file):
+    stem = file.split(".", 1)[0]
+    return len(stem) == KEY_LENGTH and all(c in "0123456789abcdef" for c in stem)
+
+
+def converted_path(key, extension="mp3"):
+    return f"{CONVERTED_FOLDER}/{key}.{extension}"
+
+
+def cover_path(key):
+    return f"{COVERS_FOLDER}/{key}.png"
+
+
+def thumbnail_path(path, size):
+    root, extension = os.path.splitext(path)
+    return f"{root}.{size}{extension}"
+
+
+def find_converted_path(key):
+    for extension in CONVERTED_EXTENSIONS:
+        path = converted_path(key, extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def migrate_legacy_files(key, playlist_name, stem):
+    for extension in CONVERTED_EXTENSIONS:
+        legacy = f"{CONVERTED_FOLDER}/{playlist_name}_{stem}.{extension}"
+        if os.path.exists(legacy) and find_converted_path(key) is None:
+            os.replace(legacy, converted_path(key, extension))
+    legacy = f"{COVERS_FOLDER}/{playlist_name}_{stem}.png"
+    if os.path.exists(legacy) and not os.path.exists(cover_path(key)):
+        os.replace(legacy, cover_path(key))
+
+
+def move_cached_files(old_key, new_key):
+    if old_key is None or new_key is None or old_key == new_key:
+        return
+    old_path = find_converted_path(old_key)
+    if old_path is not None and find_converted_path(new_key) is None:
+        os.replace(old_path, converted_path(new_key, old_path.rsplit(".", 1)[-1]))
+    if os.path.exists(cover_path(old_key)) and not os.path.exists(cover_path(new_key)):
+        os.replace(cover_path(old_key), cover_path(new_key))
+    remove_thumbnails(old_key)
+
+
+def remove_cached_files(key):
+    path = find_converted_path(key)
+    if path is not None:
+        os.remove(path)
+    if os.path.exists(cover_path(key)):
+        os.remove(cover_path(key))
+    remove_thumbnails(key)
+
+
+def remove_thumbnails(key):
+    for size in COVER_SIZES:
+        path = thumbnail_path(cover_path(key), size)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class MediaCache:
+    instance: "MediaCache" = None
+
+    def __init__(self):
+        self.refs: dict[str, int] = {}
+        MediaCache.instance = self
+
+    def acquire(self, realpath):
+        key = str(realpath)
+        self.refs[key] = self.refs.get(key, 0) + 1
+
+    def release(self, realpath):
+        key = str(realpath)
+        amount = self.refs.get(key, 0) - 1
+        if amount <= 0:
+            self.refs.pop(key, None)
+            return 0
+        self.refs[key] = amount
+        return amount
+
+    def references(self, realpath):
+        return self.refs.get(str(realpath), 0)
@@ -0,0 +1,110 @@
+import os
+import threading
+from ui.common import load_json, dump_json, METADATA_PATH
+from ui.persistence import Persistence
+from ui.library_store import LibraryStore
+
+
+class MetadataIndex:
+    instance: "MetadataIndex" = None
+
+    def __init__(self):
+        self.entries: dict[str, dict] = {}
+        self.changed = False
+        self.dirty: set[str] = set()
+        self.lock = threading.RLock()
+        MetadataIndex.instance = self
+
+    @staticmethod
+    def signature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def load(self):
+        if LibraryStore.instance.active:
+            data = LibraryStore.instance.load_metadata()
+        else:
+            data = load_json(METADATA_PATH, {})
+        with self.lock:
+            if isinstance(data, dict):
+                self.entries = data
+            self.changed = False
+            self.dirty = set()
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            if LibraryStore.instance.active:
+                changes = {
+                    key: dump_json(self.entries[key]) if key in self.entries else None
+                    for key in self.dirty
+                }
+            else:
+                text = dump_json(self.entries)
+            self.changed = False
+            self.dirty = set()
+        if LibraryStore.instance.active:
+            LibraryStore.instance.save_metadata(changes)
+        else:
+            Persistence.instance.write_text(METADATA_PATH, text)
+
+    def get_entry(self, realpath, signature):
+        entry = self.entries.get(str(realpath), None)
+        if entry is None or entry["signature"] != signature:
+            return None
+        return entry
+
+    def get(self, realpath, playlist_name, signature):
+        with self.lock:
+            entry = self.get_entry(realpath, signature)
+            if entry is None:
+                return None
+            pentry = entry["playlists"].get(playlist_name, None)
+            if pentry is None:
+                return None
+            return pentry | {"duration": entry.get("duration", None)}
+
+    def update(self, realpath, signature, playlist_name=None, **data):
+        if signature is None:
+            return
+        key = str(realpath)
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None or entry["signature"] != signature:
+                entry = {"signature": signature, "playlists": {}}
+                self.entries[key] = entry
+            if playlist_name is None:
+                entry.update(data)
+            else:
+                entry["playlists"].setdefault(playlist_name, {}).update(data)
+            self.changed = True
+            self.dirty.add(key)
+
+    def remove(self, realpath):
+        key = str(realpath)
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.changed = True
+                self.dirty.add(key)
+
+    def rename_playlist(self, old_name, new_name):
+        with self.lock:
+            for key, entry in self.entries.items():
+                pentry = entry["playlists"].pop(old_name, None)
+                if pentry is not None:
+                    entry["playlists"][new_name] = pentry
+                    self.changed = True
+                    self.dirty.add(key)
+
+    def prune(self, realpaths):
+        realpaths = {str(path) for path in realpaths}
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if key not in realpaths:
+                    self.entries.pop(key)
+                    self.changed = True
+                    self.dirty.add(key)
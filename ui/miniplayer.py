@@ -2,6 +2,8 @@ import mili
 import pygame
 import ctypes
 from ui.common import *
+from ui.data import NotCached
+from ui.profiler import profiled
 
 
 class MiniplayerUI:
@@ -216,8 +218,10 @@ class MiniplayerUI:
 
     def ui_line(self):
         totalw = self.window.size[0] - self.mult(8)
-        pos = self.app.get_music_pos()
-        percentage = (pos) / self.app.music.duration
+        if self.app.music.duration in [None, NotCached]:
+            percentage = 0
+        else:
+            percentage = self.app.get_music_pos() / self.app.music.duration
 
         sizeperc = totalw * percentage
         data = self.mili.line_element(
@@ -238,7 +242,7 @@ class MiniplayerUI:
     def ui_cover(self):
         cover = self.app.music_cover_image
         if self.app.music.cover is not None:
-            cover = self.app.music.cover
+            cover = self.app.music.get_large_cover()
         if self.app.music_controls.music_videoclip_cover:
             cover = self.app.music_controls.music_videoclip_cover
         if cover is None:
@@ -369,6 +373,7 @@ class MiniplayerUI:
             ) and self.can_interact():
                 action()
 
+    @profiled("miniplayer")
     def run(self):
         if self.window is None:
             return
@@ -85,6 +85,7 @@ class MoveMusicUI(UIComponent):
                 ) as it:
                     self.mili.rect({"color": (cond(self.app, it, *MENUB_CV),) * 3})
                     cover = self.app.playlist_cover
+                    playlist.request_cover()
                     if playlist.cover is not None:
                         cover = playlist.cover
                     if cover is not None:
@@ -133,20 +134,6 @@ class MoveMusicUI(UIComponent):
         if self.music.group is not None:
             self.music.group.remove(self.music)
 
-        mp3path = f"data/mp3_converted/{self.app.playlist_viewer.playlist.name}_{self.music.realstem}.mp3"
-        newmp3path = f"data/mp3_converted/{playlist.name}_{self.music.realstem}.mp3"
-        if os.path.exists(mp3path):
-            if not os.path.exists(newmp3path):
-                os.rename(mp3path, newmp3path)
-
-        coverpath = f"data/music_covers/{self.app.playlist_viewer.playlist.name}_{self.music.realstem}.png"
-        if os.path.exists(coverpath):
-            newcoverpath = (
-                f"data/music_covers/{playlist.name}_{self.music.realstem}.png"
-            )
-            if not os.path.exists(newcoverpath):
-                os.rename(coverpath, newcoverpath)
-
         self.app.playlist_viewer.playlist.remove(self.music.audiopath)
         playlist.load_music(
             [self.music.realpath, "converted"]
@@ -3,6 +3,7 @@ import pygame
 import random
 from ui.common import *
 from ui.data import NotCached
+from ui.profiler import profiled
 from ui.miniplayer import MiniplayerUI
 
 
@@ -22,6 +23,9 @@ class MusicControlsUI(UIComponent):
         self.black_cache = mili.ImageCache()
         self.music_videoclip_cover = None
         self.last_videoclip_cover = None
+        self.bg_source = None
+        self.bg_color = None
+        self.bg_time = 0
         self.timebar_controlled = False
         self.timebar_pos = None
         self.handle_percentage = None
@@ -42,12 +46,14 @@ class MusicControlsUI(UIComponent):
         self.minip_image = load_icon("opennew")
         self.maxip_image = pygame.transform.flip(self.minip_image, True, True)
 
+    @profiled("music_controls")
     def ui(self):
         if self.app.modal_state != "fullscreen" and self.super_fullscreen:
             self.super_fullscreen = False
         self.cont_height = 0
         if self.app.music is None:
             return
+        self.app.music.request_cover(COVER_PRIORITY_CURRENT)
 
         if (
             self.app.menu_open
@@ -135,11 +141,7 @@ class MusicControlsUI(UIComponent):
                     it.just_released_button == pygame.BUTTON_MIDDLE
                     and self.music_videoclip_cover is not None
                 ):
-                    self.app.music.cover = self.music_videoclip_cover.copy()
-                    pygame.image.save(
-                        self.app.music.cover,
-                        f"data/music_covers/{self.app.music.playlist.name}_{self.app.music.realstem}.png",
-                    )
+                    self.app.music.set_cover_image(self.music_videoclip_cover.copy())
                 if it.absolute_hover:
                     bigcover = True
                     self.app.cursor_hover = True
@@ -160,7 +162,10 @@ class MusicControlsUI(UIComponent):
                 self.ui_time()
         elif not self.small_cont:
             self.mili.text_element(
-                "Audio format does not support track positioning",
+                "Reading track length..."
+                if self.app.music.pos_supported
+                and self.app.music.duration is NotCached
+                else "Audio format does not support track positioning",
                 {"color": (150,) * 3, "size": self.mult(18)},
                 pygame.Rect(0, 0, self.app.window.size[0], 0).move_to(
                     bottomleft=(
@@ -385,7 +390,7 @@ class MusicControlsUI(UIComponent):
             self.ui_main_controls()
 
     def ui_big_cover(self):
-        cover = self.app.music.cover
+        cover = self.app.music.get_full_cover()
         if self.music_videoclip_cover is not None:
             cover = self.music_videoclip_cover
         if cover is None or cover is self.app.music_cover_image:
@@ -526,15 +531,19 @@ class MusicControlsUI(UIComponent):
             if pos >= self.app.music.duration:
                 self.music_videoclip_cover = SURF
                 return
-            try:
-                frame = self.app.music_videoclip.get_frame(pos)
-                self.music_videoclip_cover = pygame.image.frombytes(
-                    frame.tobytes(), self.app.music_videoclip.size, "RGB"
-                )
-            except Exception:
-                return
+            self.music_videoclip_cover = self.app.music_videoclip.get_frame(
+                pos, self.get_video_size()
+            )
             self.last_videoclip_cover = self.music_videoclip_cover
 
+    def get_video_size(self):
+        if self.app.modal_state == "fullscreen" or self.big_cover:
+            return None
+        size = self.mult(90)
+        if self.minip.window is not None:
+            size = max(size, *self.minip.window.size)
+        return -(-size // VIDEO_SIZE_STEP) * VIDEO_SIZE_STEP
+
     def get_bg_effect(self):
         self.app.bg_effect = False
         if self.app.modal_state == "fullscreen" or self.super_fullscreen:
@@ -542,17 +551,37 @@ class MusicControlsUI(UIComponent):
         if not self.app.focused:
             return
         image = self.app.music.cover
-        if self.music_videoclip_cover is not None:
+        video = self.music_videoclip_cover is not None
+        if video:
             image = self.music_videoclip_cover
         if image is None:
             return
         if self.app.music_paused:
             self.app.bg_effect = True
             return
-        color = pygame.Color(pygame.transform.average_color(image))
+        self.app.set_bg_color(self.get_bg_color(image, video))
+
+    def get_bg_color(self, image, video):
+        if video:
+            if (
+                self.bg_color is not None
+                and pygame.time.get_ticks() - self.bg_time < BG_VIDEO_INTERVAL
+            ):
+                return self.bg_color
+            self.bg_time = pygame.time.get_ticks()
+            color = pygame.Color(pygame.transform.average_color(image))
+        else:
+            palette = self.app.music.get_palette()
+            if palette is not None:
+                color = pygame.Color(palette[0])
+            elif image is self.bg_source:
+                return self.bg_color
+            else:
+                color = pygame.Color(pygame.transform.average_color(image))
+            self.bg_source = image
         color.a = 40
-        self.app.bg_effect = True
-        self.app.bg_effect_image.fill(color)
+        self.bg_color = color
+        return color
 
     def action_dots(self):
         if self.dots_rect is None:
@@ -644,10 +673,7 @@ class MusicControlsUI(UIComponent):
         self.app.discord_presence.update()
 
     def move_pos_5(self, amount):
-        if not self.app.music.pos_supported and self.app.music.duration in [
-            None,
-            NotCached,
-        ]:
+        if self.app.music.duration in [None, NotCached]:
             return
         pos = self.app.get_music_pos()
         new_pos = pygame.math.clamp(pos + amount, 0, self.app.music.duration)
@@ -718,7 +744,7 @@ class MusicControlsUI(UIComponent):
             )
             self.app.play_music(
                 new_music,
-                self.app.music.playlist.musiclist.index(new_music),
+                self.app.music.playlist.index_of(new_music),
             )
             if doscroll:
                 self.app.playlist_viewer.set_scroll_to_music(True)
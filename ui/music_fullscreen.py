@@ -26,7 +26,7 @@ class MusicFullscreenUI(UIComponent):
 
             cover = self.app.music_cover_image
             if self.app.music.cover is not None:
-                cover = self.app.music.cover
+                cover = self.app.music.get_full_cover()
             if (
                 self.app.music_controls.music_videoclip_cover is not None
                 and self.app.focused
@@ -263,6 +263,7 @@ class NewPlaylistUI(UIComponent):
                     if music is self.app.music:
                         self.app.end_music()
                 self.app.playlists.remove(p)
+                p.release_cache()
         return True
 
     def close(self):
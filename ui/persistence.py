@@ -0,0 +1,115 @@
+import os
+import time
+import pathlib
+import threading
+from ui.common import *
+
+
+class Persistence:
+    instance: "Persistence" = None
+
+    def __init__(self):
+        self.snapshots: dict[str, object] = {}
+        self.pending: dict[str, tuple] = {}
+        self.writing = False
+        self.thread: threading.Thread = None
+        self.condition = threading.Condition()
+        Persistence.instance = self
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def get_journal(self, path):
+        if not os.path.exists(JOURNAL_FOLDER):
+            return []
+        stem = pathlib.Path(path).stem
+        return sorted(
+            file
+            for file in os.listdir(JOURNAL_FOLDER)
+            if file.startswith(f"{stem}.") and file.endswith(".json")
+        )
+
+    def load(self, path, content_if_not_exist):
+        try:
+            data = load_json(path, content_if_not_exist)
+        except (OSError, ValueError):
+            data = self.recover(path, content_if_not_exist)
+        self.snapshots[path] = data
+        return data
+
+    def recover(self, path, content_if_not_exist):
+        for file in reversed(self.get_journal(path)):
+            try:
+                with open(f"{JOURNAL_FOLDER}/{file}", "r") as jfile:
+                    data = parse_json(jfile.read())
+            except (OSError, ValueError):
+                continue
+            print(f"Recovered '{path}' from the journal entry '{file}'")
+            return data
+        print(f"Could not recover '{path}', starting from an empty file")
+        return content_if_not_exist
+
+    def changed(self, key, data):
+        if self.snapshots.get(key, None) == data:
+            return False
+        self.snapshots[key] = data
+        return True
+
+    def write(self, path, data, journal=False):
+        if not self.changed(path, data):
+            return False
+        self.submit(path, self.write_file, path, data, None, journal)
+        return True
+
+    def write_text(self, path, text):
+        self.submit(path, self.write_file, path, None, text, False)
+
+    def submit(self, key, func, *args):
+        with self.condition:
+            self.pending[key] = (func, args)
+            self.condition.notify_all()
+        self.start()
+
+    def write_file(self, path, data, text, journal):
+        if text is None:
+            text = dump_json(data)
+        write_text(path, text)
+        if journal:
+            self.add_journal_entry(path, text)
+
+    def flush(self):
+        if self.thread is None:
+            return
+        with self.condition:
+            while (len(self.pending) > 0 or self.writing) and self.thread.is_alive():
+                self.condition.wait(PERSISTENCE_FLUSH_TIMEOUT)
+
+    def add_journal_entry(self, path, text):
+        if not os.path.exists(JOURNAL_FOLDER):
+            os.mkdir(JOURNAL_FOLDER)
+        stem = pathlib.Path(path).stem
+        write_text(f"{JOURNAL_FOLDER}/{stem}.{time.time_ns()}.json", text)
+        for file in self.get_journal(path)[:-JOURNAL_SIZE]:
+            os.remove(f"{JOURNAL_FOLDER}/{file}")
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while len(self.pending) <= 0:
+                    self.condition.wait()
+                key = next(iter(self.pending))
+                func, args = self.pending.pop(key)
+                self.writing = True
+            try:
+                func(*args)
+            except Exception as exc:
+                print(f"Failed to save '{key}': {exc}")
+                with self.condition:
+                    self.snapshots.pop(key, None)
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
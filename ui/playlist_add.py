@@ -241,6 +241,7 @@ class PlaylistAddUI(UIComponent):
         self.app.playlist_viewer.playlist.groups.append(
             PlaylistGroup(name, self.app.playlist_viewer.playlist, [], idx)
         )
+        self.app.playlist_viewer.playlist.invalidate()
         self.close()
 
     def close(self):
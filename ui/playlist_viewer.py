@@ -1,12 +1,15 @@
 import mili
+import bisect
 import pygame
 import pathlib
+import itertools
 import platform
-import threading
 import subprocess
 from ui.common import *
-import moviepy.editor as moviepy
-from ui.data import convert_music_async
+from ui import media_cache
+from ui.media_cache import MediaCache
+from ui.conversion import ConversionQueue
+from ui.profiler import profiled
 from ui.data import Playlist, MusicData, PlaylistGroup
 from ui.playlist_add import PlaylistAddUI
 from ui.entryline import UIEntryline
@@ -25,8 +28,16 @@ class PlaylistViewerUI(UIComponent):
         self.anim_back = animation(-3)
         self.anim_search = animation(-5)
         self.menu_anims = [animation(-4) for i in range(9)]
+        self.anim_cancel = animation(-4)
         self.modal_state = "none"
         self.middle_selected: MusicData | PlaylistGroup = None
+        self.search_key = None
+        self.search_results = []
+        self.rows_paths = None
+        self.rows_key = None
+        self.prefetch_rows = None
+        self.prefetch_range = None
+        self.rows = None
         self.search_active = False
         self.search_entryline = UIEntryline("Enter search...", False)
         self.big_cover = False
@@ -59,33 +70,25 @@ class PlaylistViewerUI(UIComponent):
         self.columns_image = load_icon("columns")
 
     def sort_searched_songs(self):
-        scores = {}
-        rawsearch = self.search_entryline.text.strip()
-        search = rawsearch.lower()
-        for apath in [music.audiopath for music in self.playlist.musiclist]:
-            path = self.playlist.musictable[apath].realpath
-            score = 0
-            rawname = str(path.stem)
-            name = rawname.lower()
-            if rawsearch in rawname:
-                score += 100
-            if search in name:
-                score += 80
-            words = rawsearch.split(" ")
-            for rawword in words:
-                if rawword in rawname:
-                    score += 20
-                if rawword.lower() in name:
-                    score += 10
-                if rawword.lower() in name.replace(" ", ""):
-                    score += 5
-            scores[apath] = score
-        return [
-            v[0] for v in sorted(list(scores.items()), key=lambda x: x[1], reverse=True)
-        ]
-
-    def enter(self, playlist):
+        key = (self.playlist, self.playlist.version, self.search_entryline.text.strip())
+        if key == self.search_key:
+            return self.search_results
+        if key[2]:
+            musics = self.playlist.get_search_index().top(
+                key[2], SEARCH_LIMIT, self.playlist.index_of
+            )
+        else:
+            musics = self.playlist.musiclist
+        self.search_results = [music.audiopath for music in musics]
+        self.search_key = key
+        return self.search_results
+
+    def enter(self, playlist: Playlist):
+        if self.playlist is not None and self.playlist is not playlist:
+            self.playlist.release_covers(self.app.music)
+        playlist.load()
         self.playlist = playlist
+        self.prefetch_rows = None
         self.app.change_state("playlist")
 
     def ui_top_buttons(self):
@@ -169,6 +172,7 @@ class PlaylistViewerUI(UIComponent):
         ):
             self.ui_big_cover()
 
+    @profiled("playlist_container")
     def ui_container(self):
         with self.mili.begin(
             (0, 0, self.app.window.size[0], 0),
@@ -185,38 +189,38 @@ class PlaylistViewerUI(UIComponent):
 
                 self.ui_scrollbar()
                 self.mili.id_checkpoint(50)
-                done_groups = []
-                last_group = None
-
-                for group in self.playlist.groups:
-                    if len(group.musics) <= 0:
-                        self.ui_group(group, empty=True)
 
-                for path in paths:
-                    music = self.playlist.musictable[path]
-                    if music.check():
+                for music in ConversionQueue.instance.take_failed(self.playlist):
+                    music.check()
+                rows, heights, _ = self.get_rows(paths)
+                top = -self.scroll.get_offset()[1]
+                start = max(0, bisect.bisect_right(heights, top) - 2)
+                end = min(
+                    len(rows),
+                    bisect.bisect_left(heights, top + self.app.window.size[1]) + 1,
+                )
+                self.prefetch_covers(rows, start, end)
+                if start > 0:
+                    self.mili.element((0, 0, 0, heights[start] - self.mult(3)))
+                for kind, obj in rows[start:end]:
+                    if kind in ["music", "pending"] and obj.check():
                         continue
-                    if last_group is not None and music.group != last_group:
+                    if kind == "empty_group":
+                        self.ui_group(obj, empty=True)
+                    elif kind == "group":
+                        self.ui_group(obj)
+                    elif kind == "group_musics":
+                        self.ui_group_musics(obj)
+                    elif kind == "line":
                         self.ui_group_line()
-                        last_group = None
-                    if not self.search_active:
-                        if music.group is not None:
-                            if music.group not in done_groups:
-                                self.ui_group(music.group)
-                                if (
-                                    music.group.mode == "h"
-                                    and not music.group.collapsed
-                                ):
-                                    self.ui_group_musics(music.group)
-                                last_group = music.group
-                                done_groups.append(music.group)
-                            if music.group.collapsed or music.group.mode == "h":
-                                last_group = None
-                                continue
-                    if music.pending:
-                        self.ui_pending(music)
-                        continue
-                    self.ui_music(music)
+                    elif kind == "pending":
+                        self.ui_pending(obj)
+                    else:
+                        self.ui_music(obj)
+                if end < len(rows):
+                    self.mili.element(
+                        (0, 0, 0, heights[-1] - heights[end] - self.mult(3))
+                    )
 
                 self.mili.text_element(
                     f"{len(self.playlist.musiclist)} track{
@@ -236,9 +240,78 @@ class PlaylistViewerUI(UIComponent):
                     {"align": "center"},
                 )
 
+    def prefetch_covers(self, rows, start, end):
+        if rows is self.prefetch_rows and (start, end) == self.prefetch_range:
+            return
+        self.prefetch_rows = rows
+        self.prefetch_range = (start, end)
+        for kind, obj in rows[
+            max(0, start - COVER_PREFETCH_ROWS) : end + COVER_PREFETCH_ROWS
+        ]:
+            if kind == "music":
+                obj.request_cover(COVER_PRIORITY_PREFETCH)
+            elif kind == "group_musics":
+                self.playlist.prefetch_covers(obj.musics)
+
+    def get_rows(self, paths):
+        key = (
+            self.playlist,
+            self.search_active,
+            self.app.ui_mult,
+            ConversionQueue.instance.version,
+            tuple(
+                (group.collapsed, group.mode, len(group.musics))
+                for group in self.playlist.groups
+            ),
+        )
+        if paths is self.rows_paths and key == self.rows_key:
+            return self.rows
+        rows = []
+        music_rows = {}
+        for group in self.playlist.groups:
+            if len(group.musics) <= 0:
+                rows.append(("empty_group", group))
+        done_groups = set()
+        last_group = None
+        for path in paths:
+            music = self.playlist.musictable[path]
+            if last_group is not None and music.group != last_group:
+                rows.append(("line", None))
+                last_group = None
+            if not self.search_active and music.group is not None:
+                if music.group not in done_groups:
+                    music_rows[music.group] = len(rows)
+                    rows.append(("group", music.group))
+                    if music.group.mode == "h" and not music.group.collapsed:
+                        rows.append(("group_musics", music.group))
+                    last_group = music.group
+                    done_groups.add(music.group)
+                if music.group.collapsed or music.group.mode == "h":
+                    music_rows[music] = music_rows[music.group]
+                    last_group = None
+                    continue
+            music_rows[music] = len(rows)
+            rows.append(("pending" if music.pending else "music", music))
+        sizes = {
+            "empty_group": self.mult(45),
+            "group": self.mult(45),
+            "group_musics": self.mult(80),
+            "line": self.mult(7),
+            "pending": self.mult(30),
+            "music": self.mult(80),
+        }
+        spacing = self.mult(3)
+        heights = [0] + list(
+            itertools.accumulate(sizes[kind] + spacing for kind, _ in rows)
+        )
+        self.rows_paths = paths
+        self.rows_key = key
+        self.rows = rows, heights, music_rows
+        return self.rows
+
     def ui_group(self, group: PlaylistGroup, empty=False):
         with self.mili.begin(
-            None,
+            (0, 0, 0, self.mult(45)),
             {
                 "fillx": "100" if not self.scrollbar.needed else "98",
                 "offset": (
@@ -249,9 +322,6 @@ class PlaylistViewerUI(UIComponent):
                 "axis": "x",
                 "align": "center",
                 "anchor": "center",
-                "resizey": {
-                    "min": self.mult(40),
-                },
                 "spacing": -self.mult(3),
             },
         ) as cont:
@@ -285,7 +355,7 @@ class PlaylistViewerUI(UIComponent):
                 {
                     "size": self.mult(18.5),
                     "growx": False,
-                    "growy": True,
+                    "growy": False,
                     "slow_grow": True,
                     "wraplen": "100",
                     "font_align": pygame.FONT_LEFT,
@@ -295,7 +365,7 @@ class PlaylistViewerUI(UIComponent):
                     0,
                     0,
                     self.app.window.size[0] / 1.01 - self.mult(50),
-                    0,
+                    self.mult(40),
                 ),
                 {"align": "center", "blocking": False},
             )
@@ -378,18 +448,40 @@ class PlaylistViewerUI(UIComponent):
         )
 
     def ui_pending(self, music: MusicData):
-        self.mili.text_element(
-            f"'{parse_music_stem(self.app, music.realstem)}' is being converted...",
+        job = ConversionQueue.instance.get_job(music)
+        name = parse_music_stem(self.app, music.realstem)
+        if job is None:
+            txt = f"'{name}' is being converted..."
+        elif job.running:
+            txt = f"'{name}' is being converted... {job.progress * 100:.0f}%"
+        else:
+            txt = f"'{name}' is waiting to be converted..."
+        it = self.mili.text_element(
+            txt,
             {
                 "size": self.mult(16),
                 "color": (170,) * 3,
                 "growx": False,
-                "slow_grow": True,
-                "wraplen": self.app.window.size[0] * 0.95,
+                "growy": False,
             },
-            None,
+            (0, 0, 0, self.mult(30)),
             {"offset": self.scroll.get_offset(), "fillx": True},
         )
+        if job is not None and self.app.can_interact():
+            if it.hovered or it.unhover_pressed:
+                self.app.cursor_hover = True
+            if it.hovered:
+                self.app.tick_tooltip("Right click to cancel the conversion")
+            if it.just_released_button == pygame.BUTTON_RIGHT:
+                self.app.open_menu(
+                    music,
+                    (
+                        self.app.close_image,
+                        self.action_cancel_conversion,
+                        self.anim_cancel,
+                        "Cancel conversion",
+                    ),
+                )
 
     def ui_scrollbar(self):
         if self.scrollbar.needed:
@@ -412,6 +504,7 @@ class PlaylistViewerUI(UIComponent):
         ret = False
         with self.mili.begin(None, mili.RESIZE | mili.PADLESS | mili.CENTER):
             coversize = 0
+            self.playlist.request_cover()
             if self.playlist.cover is not None:
                 coversize = self.mult(80)
                 with self.mili.begin(
@@ -544,6 +637,7 @@ class PlaylistViewerUI(UIComponent):
         ) as cont:
             if cont.data.absolute_rect.colliderect(((0, 0), self.app.window.size)):
                 for music in group.musics:
+                    music.request_cover()
                     if mit := self.mili.element(None, {"fillx": True, "filly": True}):
                         self.ui_music_bg(mit, music)
                         cover = music.cover_or(self.app.music_cover_image)
@@ -576,7 +670,7 @@ class PlaylistViewerUI(UIComponent):
 
     def ui_music(self, music: MusicData):
         with self.mili.begin(
-            None,
+            (0, 0, 0, self.mult(80)),
             {
                 "fillx": "100" if not self.scrollbar.needed else "98",
                 "offset": (
@@ -587,10 +681,10 @@ class PlaylistViewerUI(UIComponent):
                 "axis": "x",
                 "align": "center",
                 "anchor": "first",
-                "resizey": {"min": self.mult(80)},
             },
         ) as cont:
             if cont.data.absolute_rect.colliderect(((0, 0), self.app.window.size)):
+                music.request_cover()
                 self.ui_music_bg(cont, music)
                 imagesize = padsize = 0
                 if (
@@ -630,7 +724,7 @@ class PlaylistViewerUI(UIComponent):
                     {
                         "size": self.mult(18),
                         "growx": False,
-                        "growy": True,
+                        "growy": False,
                         "slow_grow": True,
                         "wraplen": "100",
                         "font_align": pygame.FONT_LEFT,
@@ -772,9 +866,7 @@ class PlaylistViewerUI(UIComponent):
     def action_remove_from_group(self):
         self.app.menu_data.group.remove(self.app.menu_data)
         if self.app.menu_data is self.app.music:
-            self.app.music_index = self.playlist.get_group_sorted_musics().index(
-                self.app.menu_data
-            )
+            self.app.music_index = self.playlist.index_of(self.app.menu_data)
         self.app.close_menu()
 
     def action_convert(self):
@@ -782,7 +874,7 @@ class PlaylistViewerUI(UIComponent):
             "Confirm conversion",
             "Are you sure you want to convert this audio file to an MP3 file? "
             "The original file will not be modified. MP3 files allow track positioning. "
-            f"You can find the converted file at 'data/mp3_converted/{self.playlist.name}_{self.app.menu_data.realstem}.mp3' "
+            f"You can find the converted file at '{media_cache.converted_path(self.app.menu_data.cache_key)}' "
             "which will be played automatically.",
             "warn",
             None,
@@ -791,9 +883,7 @@ class PlaylistViewerUI(UIComponent):
         if btn == 1:
             return
         music = self.app.menu_data
-        new_path = pathlib.Path(
-            f"data/mp3_converted/{self.playlist.name}_{music.realstem}.mp3"
-        ).resolve()
+        new_path = pathlib.Path(media_cache.converted_path(music.cache_key)).resolve()
         if os.path.exists(new_path):
             self.app.close_menu()
             if music is self.app.music:
@@ -801,33 +891,26 @@ class PlaylistViewerUI(UIComponent):
             music.converted = True
             return
 
-        try:
-            audiofile = moviepy.AudioFileClip(str(music.realpath))
-        except Exception as exc:
-            pygame.display.message_box(
-                "Could not convert music",
-                f"Could not convert '{music.realpath}' to MP3 due to external exception: '{exc}'.",
-                "error",
-                None,
-                ("Understood",),
-            )
-            return
-
         self.app.close_menu()
         if music is self.app.music:
             self.app.end_music()
 
-        music.audiofile = audiofile
-        music.pending = True
-        music.audio_converting = True
-        music.load_exc = None
         music.audiopath = new_path
         music.playlist.musictable.pop(music.realpath)
         music.playlist.musictable[music.audiopath] = music
-        thread = threading.Thread(
-            target=convert_music_async, args=(music, audiofile, new_path)
-        )
-        thread.start()
+        music.playlist.invalidate()
+        ConversionQueue.instance.submit(music, new_path, CONVERSION_PRIORITY_USER, True)
+
+    def action_cancel_conversion(self):
+        music = self.app.menu_data
+        self.app.close_menu()
+        if ConversionQueue.instance.cancel(music) is None:
+            return
+        if music.audio_converting:
+            music.revert_conversion()
+        else:
+            self.app.remove_from_history(music)
+            self.playlist.remove(music.audiopath)
 
     def action_search(self):
         if self.search_active:
@@ -843,6 +926,8 @@ class PlaylistViewerUI(UIComponent):
         self.modal_state = "add"
 
     def back(self):
+        if self.playlist is not None:
+            self.playlist.release_covers(self.app.music)
         self.app.change_state("list")
         self.scroll.set_scroll(0, 0)
         self.scrollbar.scroll_moved()
@@ -910,9 +995,9 @@ class PlaylistViewerUI(UIComponent):
             path = self.app.menu_data.audiopath
             self.playlist.remove(path)
             if btn == 1:
-                mp3_path = f"data/mp3_converted/{self.playlist.name}_{self.app.menu_data.realstem}.mp3"
-                if os.path.exists(mp3_path):
-                    os.remove(mp3_path)
+                music = self.app.menu_data
+                if MediaCache.instance.references(music.realpath) <= 0:
+                    media_cache.remove_cached_files(music.cache_key)
         except Exception:
             pass
         self.app.close_menu()
@@ -935,16 +1020,13 @@ class PlaylistViewerUI(UIComponent):
             if music is self.app.music:
                 musictochangeindex = music
         if musictochangeindex is not None:
-            self.app.music_index = self.playlist.get_group_sorted_musics().index(
-                musictochangeindex
-            )
+            self.app.music_index = self.playlist.index_of(musictochangeindex)
         self.playlist.groups.remove(self.app.menu_data)
+        self.playlist.invalidate()
         self.app.close_menu()
 
     def action_start_playing(self, music: MusicData):
-        self.app.play_music(
-            music, music.playlist.get_group_sorted_musics().index(music)
-        )
+        self.app.play_music(music, music.playlist.index_of(music))
 
     def stop_searching(self):
         self.search_active = False
@@ -957,30 +1039,13 @@ class PlaylistViewerUI(UIComponent):
             self.scroll.scroll(0, (self.mult(80) + 6) * incdir)
             self.scrollbar.scroll_moved()
             return
-        remove_amount = 0
-        group_amount = 0
-        line_amount = 0
-        for group in self.app.music.playlist.groups:
-            if len(group.musics) <= 0:
-                group_amount += 1
-            else:
-                if group.idx <= self.app.music_index or group is self.app.music.group:
-                    group_amount += 1
-                    if group.collapsed:
-                        remove_amount += len(group.musics)
-                    elif group.mode == "h":
-                        remove_amount += len(group.musics) - 1
-                    elif group.idx < self.app.music_index:
-                        line_amount += 1
-        self.scroll.set_scroll(
-            0,
-            (
-                ((self.app.music_index - 1) * (self.mult(80) + 3))
-                - (remove_amount * (self.mult(80) + 3))
-                + (group_amount * (self.mult(45) + 3))
-                + (line_amount * (self.mult(7) + 3))
-            ),
-        )
+        if self.search_active:
+            paths = self.sort_searched_songs()
+        else:
+            paths = self.playlist.get_group_sorted_musics(paths=True)
+        _, heights, music_rows = self.get_rows(paths)
+        row = music_rows.get(self.app.music, 0)
+        self.scroll.set_scroll(0, heights[max(0, row - 1)])
         self.scrollbar.scroll_moved()
 
     def reorder_musics_groups(self, event):
@@ -995,15 +1060,13 @@ class PlaylistViewerUI(UIComponent):
                 self.reorder_music_group(inc)
 
             if self.middle_selected is self.app.music:
-                self.app.music_index = self.playlist.get_group_sorted_musics().index(
-                    self.middle_selected
-                )
+                self.app.music_index = self.playlist.index_of(self.middle_selected)
         else:
             self.reorder_group(inc)
 
     def reorder_group(self, inc):
         sel_group = self.middle_selected  # get the list of sorted musics and groups
-        ref_list = self.playlist.get_group_sorted_musics(groups=True)
+        ref_list = self.playlist.get_group_sorted_musics(groups=True).copy()
 
         idx = ref_list.index(
             sel_group
@@ -1018,19 +1081,18 @@ class PlaylistViewerUI(UIComponent):
 
         for group in sel_group.playlist.groups:  # move the index of each group to the delta that was created while moving sel_group around
             group.idx += ref_list.index(group) - old_idxs[group]
+        self.playlist.invalidate()
 
         for music in (
             sel_group.musics
         ):  # if any music inside the group was playing, reset its index
             if music is self.app.music:
-                self.app.music_index = self.playlist.get_group_sorted_musics().index(
-                    music
-                )
+                self.app.music_index = self.playlist.index_of(music)
                 break
 
     def reorder_music_nogroup(self, inc):
         music = self.middle_selected  # get the list of sorted musics and groups
-        ref_list = self.playlist.get_group_sorted_musics(groups=True)
+        ref_list = self.playlist.get_group_sorted_musics(groups=True).copy()
 
         r_idx = self.playlist.musiclist.index(
             music
@@ -1061,6 +1123,7 @@ class PlaylistViewerUI(UIComponent):
                 music
             )  # if no group moved modify its index in the original list
             self.playlist.musiclist.insert(r_newidx, music)
+        self.playlist.invalidate()
 
     def reorder_music_group(self, inc):
         music = self.middle_selected
@@ -1071,6 +1134,7 @@ class PlaylistViewerUI(UIComponent):
 
         music.group.musics.remove(music)
         music.group.musics.insert(new_idx, music)
+        self.playlist.invalidate()
 
     def event(self, event):
         modal_exit = False
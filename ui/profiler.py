@@ -0,0 +1,85 @@
+import time
+import bisect
+import functools
+import threading
+import collections
+from ui.common import *
+
+
+def profiled(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = Profiler.instance
+            if profiler is None or not profiler.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(name, start, time.perf_counter())
+
+        return wrapper
+
+    return decorator
+
+
+class Profiler:
+    instance: "Profiler" = None
+
+    def __init__(self):
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.samples: dict[str, collections.deque[float]] = {}
+        self.trace = collections.deque(maxlen=PROFILER_TRACE_LEN)
+        Profiler.instance = self
+
+    def toggle(self):
+        if self.enabled:
+            self.enabled = False
+            self.export()
+        else:
+            self.samples = {}
+            self.trace.clear()
+            self.enabled = True
+
+    def record(self, name, start, end):
+        duration = (end - start) * 1000
+        samples = self.samples.get(name, None)
+        if samples is None:
+            samples = collections.deque(maxlen=PROFILER_SAMPLES)
+            self.samples[name] = samples
+        samples.append(duration)
+        self.trace.append(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.origin) * 1000000,
+                "dur": duration * 1000,
+                "pid": 0,
+                "tid": threading.get_ident(),
+            }
+        )
+
+    def get_stats(self, name):
+        samples = sorted(self.samples[name])
+        return (
+            sum(samples) / len(samples),
+            samples[int((len(samples) - 1) * 0.95)],
+            samples[-1],
+        )
+
+    def get_histogram(self, name):
+        buckets = [0] * (len(PROFILER_BUCKETS) + 1)
+        for sample in self.samples[name]:
+            buckets[bisect.bisect_left(PROFILER_BUCKETS, sample)] += 1
+        return buckets
+
+    def export(self):
+        if len(self.trace) <= 0:
+            return
+        write_json(
+            PROFILER_TRACE_PATH,
+            {"traceEvents": list(self.trace), "displayTimeUnit": "ms"},
+        )
+        print(f"Profiler trace saved to {PROFILER_TRACE_PATH}")
@@ -2,6 +2,7 @@ import os
 import mili
 import pygame
 from ui.common import *
+from ui import media_cache
 from ui.data import MusicData
 from ui.entryline import UIEntryline
 
@@ -120,17 +121,9 @@ class RenameMusicUI(UIComponent):
             self.close()
             return
 
-        mp3path = f"data/mp3_converted/{self.app.playlist_viewer.playlist.name}_{self.music.realstem}.mp3"
-        newmp3path = f"data/mp3_converted/{self.app.playlist_viewer.playlist.name}_{new_stem}.mp3"
-        if os.path.exists(mp3path):
-            if not os.path.exists(newmp3path):
-                os.rename(mp3path, newmp3path)
-
-        coverpath = f"data/music_covers/{self.app.playlist_viewer.playlist.name}_{self.music.realstem}.png"
-        if os.path.exists(coverpath):
-            newcoverpath = f"data/music_covers/{self.app.playlist_viewer.playlist.name}_{new_stem}.png"
-            if not os.path.exists(newcoverpath):
-                os.rename(coverpath, newcoverpath)
+        media_cache.move_cached_files(
+            self.music.cache_key, media_cache.cache_key(new_path)
+        )
 
         idx = self.app.playlist_viewer.playlist.musiclist.index(self.music)
         self.app.playlist_viewer.playlist.remove(self.music.audiopath)
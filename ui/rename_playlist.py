@@ -4,6 +4,7 @@ import pygame
 import pathlib
 from ui.common import *
 from ui.entryline import UIEntryline
+from ui.metadata import MetadataIndex
 
 
 class RenamePlaylistUI(UIComponent):
@@ -110,7 +111,7 @@ class RenamePlaylistUI(UIComponent):
     def final_rename(self, name):
         old_name = self.app.menu_data.name
         for file in os.listdir("data/mp3_converted"):
-            if file.startswith(old_name):
+            if file.startswith(f"{old_name}_"):
                 old_path = pathlib.Path(f"data/mp3_converted/{file}").resolve()
                 new_path = pathlib.Path(
                     f"data/mp3_converted/{name}{file.removeprefix(old_name)}"
@@ -118,7 +119,7 @@ class RenamePlaylistUI(UIComponent):
                 if not os.path.exists(new_path):
                     os.rename(old_path, new_path)
         for file in os.listdir("data/music_covers"):
-            if file.startswith(old_name):
+            if file.startswith(f"{old_name}_"):
                 old_path = pathlib.Path(f"data/music_covers/{file}").resolve()
                 new_path = pathlib.Path(
                     f"data/music_covers/{name}{file.removeprefix(old_name)}"
@@ -128,15 +129,12 @@ class RenamePlaylistUI(UIComponent):
         if os.path.exists(f"data/covers/{old_name}.png"):
             if not os.path.exists(f"data/covers/{name}.png"):
                 os.rename(f"data/covers/{old_name}.png", f"data/covers/{name}.png")
-        self.app.menu_data.__init__(
-            name,
-            [
-                [music.realpath, "converted"] if music.converted else music.realpath
-                for music in self.app.menu_data.musictable
-            ],
-            self.app.menu_data.groups,
-            self.app.loading_image,
-        )
+        playlist = self.app.menu_data
+        playlist.name = name
+        if playlist.cover_request == f"data/covers/{old_name}.png":
+            playlist.cover_request = f"data/covers/{name}.png"
+        MetadataIndex.instance.rename_playlist(old_name, name)
+        playlist.invalidate()
 
     def close(self):
         self.entryline.text = ""
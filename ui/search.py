@@ -0,0 +1,276 @@
+import time
+import heapq
+import unicodedata
+
+GRAM_SIZE = 3
+WORD_CACHE_SIZE = 256
+FUZZY_SCORE = 5
+FUZZY_MIN_HITS = 50
+FUZZY_CANDIDATES = 200
+SYNC_BUDGET = 0.004
+
+
+def strip_youtube_id(stem: str):
+    if len(stem) >= 14:
+        if stem.endswith("]") and stem[-13] == "[" and stem[-14] == " ":
+            return stem[:-14]
+    return stem
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", strip_youtube_id(text))
+    return "".join(char for char in text if not unicodedata.combining(char)).casefold()
+
+
+def get_grams(text):
+    return {text[i : i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def max_typos(word):
+    if len(word) < 4:
+        return 0
+    if len(word) < 8:
+        return 1
+    return 2
+
+
+def edit_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            distance = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            )
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def score_entry(entry, rawsearch, search, rawwords, words, fuzzy_words=()):
+    rawname, name, compact, name_words = entry
+    score = 0
+    if rawsearch in rawname:
+        score += 100
+    if search in name:
+        score += 80
+    for rawword, word in zip(rawwords, words):
+        if rawword in rawname:
+            score += 20
+        if word in name:
+            score += 10
+        if word in compact:
+            score += 5
+            continue
+        if word not in fuzzy_words:
+            continue
+        typos = max_typos(word)
+        distance = min(
+            (
+                edit_distance(word, name_word, typos)
+                for name_word in name_words
+                if abs(len(name_word) - len(word)) <= typos
+            ),
+            default=typos + 1,
+        )
+        if distance <= typos:
+            score += FUZZY_SCORE - distance
+    return score
+
+
+class SearchIndex:
+    def __init__(self):
+        self.names = {}
+        self.grams: dict[str, set] = {}
+        self.word_grams: dict[str, set] = {}
+        self.word_cache: dict[str, set] = {}
+        self.fuzzy_cache: dict[str, set] = {}
+        self.query_cache: dict[str, dict] = {}
+        self.version = 0
+
+    def add(self, obj, rawname):
+        if obj in self.names:
+            self.remove(obj)
+        name = normalize(rawname)
+        compact = name.replace(" ", "")
+        name_words = set(name.split())
+        self.names[obj] = (rawname, name, compact, name_words)
+        for gram in get_grams(name) | get_grams(compact):
+            self.grams.setdefault(gram, set()).add(obj)
+        for gram in self.get_word_grams(name_words):
+            self.word_grams.setdefault(gram, set()).add(obj)
+        self.changed()
+
+    def remove(self, obj):
+        entry = self.names.pop(obj, None)
+        if entry is None:
+            return
+        for grams, index in [
+            (get_grams(entry[1]) | get_grams(entry[2]), self.grams),
+            (self.get_word_grams(entry[3]), self.word_grams),
+        ]:
+            for gram in grams:
+                objs = index.get(gram, None)
+                if objs is None:
+                    continue
+                objs.discard(obj)
+                if len(objs) <= 0:
+                    index.pop(gram)
+        self.changed()
+
+    def changed(self):
+        self.version += 1
+        self.word_cache = {}
+        self.fuzzy_cache = {}
+        self.query_cache = {}
+
+    def get_word_grams(self, words):
+        grams = set()
+        for word in words:
+            grams |= get_grams(f" {word} ")
+        return grams
+
+    def lookup(self, word):
+        if len(word) < GRAM_SIZE:
+            return self.names.keys()
+        postings = sorted(
+            (
+                self.grams.get(word[i : i + GRAM_SIZE], set())
+                for i in range(len(word) - GRAM_SIZE + 1)
+            ),
+            key=len,
+        )
+        return postings[0].intersection(*postings[1:])
+
+    def candidates(self, word):
+        cached = self.word_cache.get(word, None)
+        if cached is not None:
+            return cached
+        base = None
+        for i in range(len(word) - 1, 0, -1):
+            base = self.word_cache.get(word[:i], None)
+            if base is not None:
+                break
+        if base is None:
+            base = self.lookup(word)
+        result = {
+            obj
+            for obj in base
+            if word in self.names[obj][1] or word in self.names[obj][2]
+        }
+        if len(self.word_cache) >= WORD_CACHE_SIZE:
+            self.word_cache = {}
+        self.word_cache[word] = result
+        return result
+
+    def fuzzy_candidates(self, word):
+        cached = self.fuzzy_cache.get(word, None)
+        if cached is not None:
+            return cached
+        grams = get_grams(f" {word} ")
+        threshold = max(1, len(grams) - (GRAM_SIZE + 1) * max_typos(word))
+        counts = {}
+        for gram in grams:
+            for obj in self.word_grams.get(gram, ()):
+                counts[obj] = counts.get(obj, 0) + 1
+        result = set(
+            heapq.nlargest(
+                FUZZY_CANDIDATES,
+                (obj for obj, count in counts.items() if count >= threshold),
+                key=counts.get,
+            )
+        )
+        if len(self.fuzzy_cache) >= WORD_CACHE_SIZE:
+            self.fuzzy_cache = {}
+        self.fuzzy_cache[word] = result
+        return result
+
+    def search(self, rawsearch):
+        scores = self.query_cache.get(rawsearch, None)
+        if scores is not None:
+            return scores
+        search = normalize(rawsearch)
+        rawwords = rawsearch.split(" ")
+        words = [normalize(word) for word in rawwords]
+        fuzzy = {}
+        if "" in words:
+            candidates = self.names.keys()
+        else:
+            candidates = set()
+            for word in words:
+                candidates |= self.candidates(word)
+            if len(candidates) < FUZZY_MIN_HITS:
+                for word in words:
+                    if max_typos(word) > 0:
+                        fuzzy[word] = self.fuzzy_candidates(word)
+                        candidates |= fuzzy[word]
+        scores = {}
+        for obj in candidates:
+            fuzzy_words = [word for word, objs in fuzzy.items() if obj in objs]
+            score = score_entry(
+                self.names[obj], rawsearch, search, rawwords, words, fuzzy_words
+            )
+            if score > 0:
+                scores[obj] = score
+        if len(self.query_cache) >= WORD_CACHE_SIZE:
+            self.query_cache = {}
+        self.query_cache[rawsearch] = scores
+        return scores
+
+    def top(self, rawsearch, limit, order):
+        scores = self.search(rawsearch)
+        return heapq.nlargest(
+            limit, scores, key=lambda obj: (scores[obj], -order(obj))
+        )
+
+
+class LibraryIndex:
+    instance: "LibraryIndex" = None
+
+    def __init__(self):
+        self.index = SearchIndex()
+        self.states = {}
+        self.entries: dict[object, set] = {}
+        self.pending = []
+        LibraryIndex.instance = self
+
+    @property
+    def indexing(self):
+        return len(self.pending) > 0
+
+    def sync(self, playlists, budget=SYNC_BUDGET):
+        current = set(playlists)
+        for playlist in list(self.states):
+            if playlist not in current:
+                self.states.pop(playlist)
+                for path in self.entries.pop(playlist, ()):
+                    self.index.remove((playlist, path))
+        for playlist in playlists:
+            state = (playlist.version, playlist.loaded)
+            if self.states.get(playlist, None) == state:
+                continue
+            self.states[playlist] = state
+            old = self.entries.get(playlist, set())
+            new = set(playlist.realpaths)
+            for path in old - new:
+                self.index.remove((playlist, path))
+            self.pending.extend((playlist, path) for path in new - old)
+            self.entries[playlist] = new
+        start = time.perf_counter()
+        while len(self.pending) > 0 and time.perf_counter() - start < budget:
+            playlist, path = self.pending.pop()
+            if path in self.entries.get(playlist, ()):
+                self.index.add((playlist, path), path.stem)
+
+    def top(self, rawsearch, limit, playlists):
+        order = {playlist: i for i, playlist in enumerate(playlists)}
+        return self.index.top(rawsearch, limit, lambda key: order.get(key[0], 0))
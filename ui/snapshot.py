@@ -0,0 +1,134 @@
+import os
+import marshal
+from ui.common import *
+from ui.metadata import MetadataIndex
+
+SNAPSHOT_SOURCES = ["data/playlists.json", "data/history.json"]
+
+
+class PathTable:
+    def __init__(self, folders=None):
+        self.folders: list[str] = [] if folders is None else folders
+        self.indices: dict[str, int] = {}
+
+    def encode(self, path):
+        name = os.path.basename(path)
+        folder = path[: len(path) - len(name)]
+        index = self.indices.get(folder, None)
+        if index is None:
+            index = len(self.folders)
+            self.indices[folder] = index
+            self.folders.append(folder)
+        return index, name
+
+    def encode_paths(self, paths):
+        indices, names, converted = [], [], []
+        for i, path in enumerate(paths):
+            if not isinstance(path, str):
+                path = path[0]
+                converted.append(i)
+            index, name = self.encode(path)
+            indices.append(index)
+            names.append(name)
+        return indices, names, converted
+
+    def decode_paths(self, encoded):
+        indices, names, converted = encoded
+        folders = self.folders
+        paths = [folders[index] + name for index, name in zip(indices, names)]
+        for i in converted:
+            paths[i] = [paths[i], "converted"]
+        return paths
+
+
+def encode_snapshot(playlist_data, history_data, signatures):
+    table = PathTable()
+    playlists = [
+        (
+            pdata["name"],
+            table.encode_paths(pdata["paths"]),
+            [
+                (
+                    group["name"],
+                    group.get("idx", 0),
+                    group.get("collapsed", True),
+                    group.get("mode", "h"),
+                    table.encode_paths(group["paths"]),
+                )
+                for group in pdata.get("groups", [])
+            ],
+        )
+        for pdata in playlist_data
+    ]
+    history = [
+        (
+            hdata["playlist"],
+            *table.encode(hdata["audiopath"]),
+            hdata["position"],
+            hdata.get("duration", None),
+        )
+        for hdata in history_data
+    ]
+    return marshal.dumps(
+        (SNAPSHOT_VERSION, signatures, table.folders, playlists, history)
+    )
+
+
+def decode_snapshot(content):
+    version, signatures, folders, playlists, history = marshal.loads(content)
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}")
+    table = PathTable(folders)
+    playlist_data = [
+        {
+            "name": name,
+            "paths": table.decode_paths(paths),
+            "groups": [
+                {
+                    "name": gname,
+                    "idx": idx,
+                    "collapsed": collapsed,
+                    "mode": mode,
+                    "paths": table.decode_paths(gpaths),
+                }
+                for gname, idx, collapsed, mode, gpaths in groups
+            ],
+        }
+        for name, paths, groups in playlists
+    ]
+    history_data = [
+        {
+            "audiopath": folders[index] + name,
+            "position": position,
+            "playlist": playlist,
+            "duration": duration,
+        }
+        for playlist, index, name, position, duration in history
+    ]
+    return signatures, playlist_data, history_data
+
+
+def get_source_signatures():
+    return [MetadataIndex.signature(path) for path in SNAPSHOT_SOURCES]
+
+
+def write_snapshot(playlist_data, history_data):
+    content = encode_snapshot(playlist_data, history_data, get_source_signatures())
+    temp_path = f"{SNAPSHOT_PATH}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(content)
+    os.replace(temp_path, SNAPSHOT_PATH)
+
+
+def load_snapshot():
+    if not os.path.exists(SNAPSHOT_PATH):
+        return None
+    try:
+        with open(SNAPSHOT_PATH, "rb") as file:
+            signatures, playlist_data, history_data = decode_snapshot(file.read())
+    except (OSError, ValueError, EOFError, TypeError) as exc:
+        print(f"Ignoring the startup snapshot: {exc}")
+        return None
+    if None in signatures or signatures != get_source_signatures():
+        return None
+    return playlist_data, history_data
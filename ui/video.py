@@ -0,0 +1,161 @@
+import pygame
+import threading
+import collections
+import moviepy.editor as moviepy
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+from ui.common import *
+
+
+def get_scaled_size(size, limit):
+    w, h = size
+    if limit is None:
+        return w, h
+    ratio = limit / max(w, h)
+    if ratio >= 1:
+        return w, h
+    return max(1, int(w * ratio)), max(1, int(h * ratio))
+
+
+class VideoDecoder:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.clip: moviepy.VideoFileClip = None
+        self.clip_limit = None
+        self.source_size = None
+        self.frames: collections.deque[tuple[float, pygame.Surface]] = (
+            collections.deque()
+        )
+        self.current: pygame.Surface = None
+        self.upload: pygame.Surface = None
+        self.slots: list[pygame.Surface] = []
+        self.allocations = 0
+        self.next_time = 0
+        self.generation = 0
+        self.closed = False
+        self.failed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    @property
+    def frame_time(self):
+        if self.clip is None or not self.clip.fps:
+            return 1 / VIDEO_FALLBACK_FPS
+        return 1 / self.clip.fps
+
+    def restart(self, position):
+        self.frames.clear()
+        self.next_time = max(0, position)
+        self.generation += 1
+        self.condition.notify()
+
+    def get_frame(self, position, size):
+        with self.condition:
+            if size != self.size:
+                self.size = size
+                self.restart(position)
+                return self.current
+            while len(self.frames) > 1 and self.frames[1][0] <= position:
+                self.frames.popleft()
+                self.condition.notify()
+            if len(self.frames) <= 0:
+                if abs(self.next_time - position) > VIDEO_SEEK_TOLERANCE:
+                    self.restart(position)
+                return self.current
+            frame_time, surface = self.frames[0]
+            if abs(frame_time - position) > VIDEO_SEEK_TOLERANCE:
+                self.restart(position)
+                return self.current
+            self.current = surface
+            return surface
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.frames.clear()
+            self.condition.notify()
+
+    def is_waiting(self):
+        return not self.closed and (
+            len(self.frames) >= VIDEO_RING_SIZE or self.next_time >= self.clip.duration
+        )
+
+    def get_slot(self, size):
+        if len(self.slots) <= 0 or self.slots[0].get_size() != size:
+            self.slots = [pygame.Surface(size) for i in range(VIDEO_RING_SIZE + 2)]
+            self.allocations += len(self.slots)
+        used = {id(surface) for _, surface in self.frames}
+        used.add(id(self.current))
+        for slot in self.slots:
+            if id(slot) not in used:
+                return slot
+
+    def upload_frame(self, frame, slot: pygame.Surface):
+        array = frame.swapaxes(0, 1)
+        if slot.get_size() == array.shape[:2]:
+            pygame.surfarray.blit_array(slot, array)
+            return
+        if self.upload is None or self.upload.get_size() != array.shape[:2]:
+            self.upload = pygame.Surface(array.shape[:2])
+            self.allocations += 1
+        pygame.surfarray.blit_array(self.upload, array)
+        pygame.transform.smoothscale(self.upload, slot.get_size(), slot)
+
+    def decode(self, time, size):
+        frame = self.clip.get_frame(time)
+        with self.condition:
+            slot = self.get_slot(get_scaled_size(self.clip.size, size))
+        self.upload_frame(frame, slot)
+        return slot
+
+    def open_clip(self, limit):
+        if self.clip is not None:
+            self.clip.close()
+            self.clip = None
+        target_resolution = None
+        if limit is not None:
+            if self.source_size is None:
+                self.source_size = ffmpeg_parse_infos(str(self.path))["video_size"]
+            w, h = get_scaled_size(self.source_size, limit)
+            target_resolution = (h, w)
+        self.clip = moviepy.VideoFileClip(
+            str(self.path), audio=False, target_resolution=target_resolution
+        )
+        self.clip_limit = limit
+
+    def worker(self):
+        try:
+            self.open_clip(self.size)
+        except Exception:
+            self.failed = True
+            return
+        try:
+            while True:
+                with self.condition:
+                    while self.is_waiting():
+                        self.condition.wait()
+                    if self.closed:
+                        return
+                    time = self.next_time
+                    size = self.size
+                    generation = self.generation
+                if size != self.clip_limit:
+                    try:
+                        self.open_clip(size)
+                    except Exception:
+                        self.failed = True
+                        return
+                try:
+                    surface = self.decode(time, size)
+                except Exception:
+                    surface = None
+                with self.condition:
+                    if generation != self.generation:
+                        continue
+                    if surface is not None:
+                        self.frames.append((time, surface))
+                    self.next_time = time + self.frame_time
+        finally:
+            if self.clip is not None:
+                self.clip.close()